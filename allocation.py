@@ -0,0 +1,134 @@
+#######################
+# Imports
+#######################
+import numpy as np
+import pandas as pd
+
+from pypfopt.discrete_allocation import DiscreteAllocation
+from pypfopt.exceptions import OptimizationError
+
+import covariance
+
+#######################
+# Configs
+#######################
+METHODS = ['largest_remainder', 'lp']
+
+
+# ================================================
+# helpers
+# ================================================
+
+def _align(weights, latest_prices):
+    # long-only weights on the tickers with a price, zero weights dropped
+    weights = pd.Series(weights, dtype=float)
+    if (weights < 0).any():
+        raise ValueError('Only long-only weights can be allocated')
+    weights = weights[weights > 0]
+    prices = pd.Series(latest_prices, dtype=float).reindex(weights.index)
+    if prices.isna().any() or (prices <= 0).any():
+        raise ValueError(f'No valid latest price for {", ".join(prices.index[~(prices > 0)])}')
+    return weights, prices
+
+
+def _errors(shares, prices, weights, values, risk=None):
+    # weight RMSE over the invested value (as pypfopt's allocation report)
+    # and, with a risk root, the ex-ante tracking error of the account (cash included)
+    # against the target weights
+    invested = shares @ prices
+    with np.errstate(invalid='ignore', divide='ignore'):
+        held = shares * prices / invested[:, None]
+    rmse = np.sqrt(np.mean((np.nan_to_num(held) - weights) ** 2, axis=1))
+
+    tracking_error = None
+    if risk is not None:
+        root, specific = risk
+        active = shares * prices / values[:, None] - weights
+        tracking_error = np.sqrt(np.sum((active @ root) ** 2, axis=1) + (active ** 2) @ specific)
+    return rmse, tracking_error
+
+
+# ================================================
+# largest remainder over many account sizes at once
+# ================================================
+
+def _largest_remainder(weights, prices, values):
+    # floor of the exact share counts, then the leftover cash buys one more share
+    # of the assets with the largest fractional remainder first, row by row in lockstep;
+    # finally the leftover goes greedily to the most underweight affordable asset
+    exact = values[:, None] * weights / prices
+    shares = np.floor(exact)
+    leftover = values - shares @ prices
+
+    rows = np.arange(len(values))
+    order = np.argsort(-(exact - shares), axis=1, kind='stable')
+    for rank in range(len(prices)):
+        asset = order[:, rank]
+        buy = leftover >= prices[asset]
+        shares[rows[buy], asset[buy]] += 1
+        leftover[buy] -= prices[asset[buy]]
+
+    # leftover smaller than the cheapest remaining candidate only after this loop
+    while True:
+        affordable = prices[None, :] <= leftover[:, None]
+        active = affordable.any(axis=1)
+        if not active.any():
+            break
+        deficit = np.where(affordable, values[:, None] * weights - shares * prices, -np.inf)
+        asset = np.argmax(deficit, axis=1)
+        shares[rows[active], asset[active]] += 1
+        leftover[active] -= prices[asset[active]]
+    return shares, leftover
+
+
+def _lp(weights, prices, value, tickers):
+    allocation, leftover = DiscreteAllocation(dict(zip(tickers, weights)),
+                                              pd.Series(prices, index=tickers),
+                                              total_portfolio_value=value).lp_portfolio()
+    return np.array([allocation.get(t, 0) for t in tickers], dtype=float), float(leftover)
+
+
+def allocate_batch(weights, latest_prices, portfolio_values, method='largest_remainder', Sigma=None):
+    # share counts of every account size from the same weights
+    # weights: {ticker: weight}, latest_prices: Series, portfolio_values: list of amounts,
+    # Sigma (dense or covariance.FactorCovariance) adds the ex-ante tracking error,
+    # method 'lp' refines every account with pypfopt's integer LP and keeps whichever
+    # of the two tracks the weights better (or the largest remainder result if the LP fails)
+    # returns {'shares': accounts x tickers, 'leftover', 'weight_rmse', 'tracking_error'}
+    weights, prices = _align(weights, latest_prices)
+    tickers = list(weights.index)
+    values = np.asarray(portfolio_values, dtype=float).ravel()
+    w, p = weights.to_numpy() / weights.sum(), prices.to_numpy()
+    risk = None if Sigma is None else covariance.risk_root(Sigma, tickers)
+
+    shares, leftover = _largest_remainder(w, p, values)
+    rmse, tracking_error = _errors(shares, p, w, values, risk)
+
+    if method == 'lp':
+        for i, value in enumerate(values):
+            try:
+                lp_shares, lp_leftover = _lp(w, p, value, tickers)
+            except OptimizationError:
+                continue
+            lp_rmse, lp_tracking_error = _errors(lp_shares[None, :], p, w, values[i:i + 1], risk)
+            better = lp_tracking_error[0] < tracking_error[i] if risk is not None else lp_rmse[0] < rmse[i]
+            if better:
+                shares[i], leftover[i], rmse[i] = lp_shares, lp_leftover, lp_rmse[0]
+                if risk is not None:
+                    tracking_error[i] = lp_tracking_error[0]
+    elif method != 'largest_remainder':
+        raise ValueError(f'Unknown allocation method: {method}')
+
+    index = pd.Index(values, name='portfolio value')
+    return {'shares': pd.DataFrame(shares.astype(np.int64), index=index, columns=tickers),
+            'leftover': pd.Series(leftover, index=index, name='leftover'),
+            'weight_rmse': pd.Series(rmse, index=index, name='weight_rmse'),
+            'tracking_error': None if tracking_error is None
+                              else pd.Series(tracking_error, index=index, name='tracking_error')}
+
+
+def allocate(weights, latest_prices, portfolio_value, method='largest_remainder'):
+    # one account, same result shape as DiscreteAllocation: ({ticker: shares}, leftover)
+    result = allocate_batch(weights, latest_prices, [portfolio_value], method=method)
+    shares = result['shares'].iloc[0]
+    return {t: int(n) for t, n in shares.items() if n > 0}, float(result['leftover'].iloc[0])
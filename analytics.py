@@ -1,11 +1,17 @@
 import datetime as dt
 
-import yfinance as yf
 import streamlit as st
-import pandas as pd
 import plotly.graph_objects as go
-import plotly.io as pio
-pio.renderers.default = 'browser'
+
+import price_store
+import resampling
+import return_stats
+import decimation
+import drawdown
+import tracing
+import debug_panel
+import shared_prices
+
 
 def app(tickers):
     # added preloaded tickers list
@@ -24,18 +30,35 @@ def app(tickers):
                                      key='end_date')
 
 
-    try: # without 'try' there is an error
-        start_date = st.session_state['start_date']
-        end_date = st.session_state['end_date']
-        df = yf.download(tickers_selection).reset_index()
-        df.columns = df.columns.map(''.join)
-        df = df.query(' Date <= @end_date and Date >= @start_date')   # this string brings an error
-    except:
-        # place an error print here
-        pass
+    # long histories are decimated on the server, extremes and troughs are kept
+    point_budget = int(st.number_input('Points per line (0 = all)', min_value=0, max_value=100000,
+                                       value=decimation.POINT_BUDGET, step=500, key='point_budget'))
+    st.checkbox('Show timings', key='analytics_debug_info')
+    # half the memory per price, plenty of precision for charts and statistics
+    st.checkbox('Compact prices (float32)', key='analytics_float32')
+
+    # every chart below is a span of this trace
+    trace = tracing.start_trace('analytics')
+
+    start_date = st.session_state['start_date']
+    end_date = st.session_state['end_date']
+    # only the selected window is read from the price store,
+    # tickers are downloaded concurrently and a failing one doesn't stop the rest
+    # prices is a (field x ticker x time) panel shared with the other sessions,
+    # every field / ticker lookup below is a view on it
+    with tracing.span('download') as download:
+        prices, failures = price_store.load_panel(tickers_selection, start=start_date, end=end_date,
+                                                  dtype='float32' if st.session_state['analytics_float32'] else 'float64')
+        download.rows = prices.size
+    if not failures.empty:
+        st.warning(f'Could not download {", ".join(failures.index)}')
+        st.dataframe(failures)
+    if prices.empty:
+        st.stop()
+    adj_close = prices.frame('Adj Close')
 
     # try:
-    #     st.write(df.head())
+    #     st.write(adj_close.head())
     # except:
     #     pass
 
@@ -46,45 +69,39 @@ def app(tickers):
 # ================================================
 
     cumprod_container = st.container()
-    with cumprod_container:
-        df_cumprod = df.loc[:, df.columns.str.contains('Adj Close') | df.columns.str.contains('Date')]
-        df_cumprod = df_cumprod.set_index('Date')
-        df_cumprod = (df_cumprod.pct_change() + 1).cumprod()
+    with cumprod_container, tracing.span('cumulative return chart', rows=adj_close.size):
+        df_cumprod = return_stats.cumulative_returns(adj_close)
         fig = go.Figure()
-        for i in range(len(df_cumprod.columns)):
-            fig.add_trace(go.Scatter(x=df_cumprod.index, y=df_cumprod.iloc[:, i],
-                                              name=df_cumprod.columns[i].replace('Adj Close', '')))
+        for line_trace in decimation.line_traces({ticker: df_cumprod[ticker] for ticker in df_cumprod.columns},
+                                            'cumulative return', point_budget):
+            fig.add_trace(line_trace)
         fig.update_layout(barmode='overlay', width=1400, height=500, title_text='Daily cumulative return chart')
         fig.update_traces(opacity=0.75)
         st.plotly_chart(fig)
 
     hist_container = st.container()
     with hist_container:
-        df_close = df.loc[:, df.columns.str.contains('Adj Close')]
-        df_close = df_close.pct_change()
-        fig = go.Figure()
-        for i in range(len(df_close.columns)):
-            fig.add_trace(
-                go.Histogram(x=df_close.iloc[:, i], name=df_close.columns[i].replace('Adj Close', ''), xbins=dict(
-                    start=-1,
-                    end=1,
-                    size=0.005),
-                             autobinx=False))
-
-        # Overlay both histograms
-        fig.update_layout(barmode='overlay', width=1400, height=500, title_text='Daily return histogram')
-        # Reduce opacity to see both histograms
-        fig.update_traces(opacity=0.75)
-        st.plotly_chart(fig)
+        with tracing.span('return histogram', rows=adj_close.size):
+            df_close = return_stats.daily_returns(adj_close)
+            # counts of all tickers binned here, only the bars go to the browser
+            df_counts = return_stats.cached_return_histograms(df_close)
+            width = df_counts.index[1] - df_counts.index[0]
+            fig = go.Figure()
+            for i in range(len(df_counts.columns)):
+                fig.add_trace(
+                    go.Bar(x=df_counts.index, y=df_counts.iloc[:, i], name=df_counts.columns[i],
+                           width=width))
+
+            # Overlay both histograms
+            fig.update_layout(barmode='overlay', width=1400, height=500, title_text='Daily return histogram')
+            # Reduce opacity to see both histograms
+            fig.update_traces(opacity=0.75)
+            st.plotly_chart(fig)
 
-        dfd = df_close.describe([.025, .25, .5, .75, .975])
-        dfk = df_close.kurtosis().rename('kurtosis')
-        dfs = df_close.skew().rename('skew')
-        dfd = dfd.T.join(dfk).join(dfs).drop('count', axis=1)
-        dfd['range'] = dfd['max'] - dfd['min']
-        dfd['IQR'] = dfd['75%'] - dfd['25%']
-        dfd.index = [x.replace('Adj Close', '') for x in dfd.index]
-        st.dataframe(dfd, width=1500)
+        with tracing.span('distribution table', rows=df_close.size):
+            # one pass over the returns, a refresh only adds its new rows
+            dfd = return_stats.streaming_distribution_table(df_close)
+            st.dataframe(dfd, width=1500)
 
         # ================================================
         # Построение свечек
@@ -93,45 +110,26 @@ def app(tickers):
     candles_container = st.container()
     with candles_container:
 
-        candles_selection = st.selectbox('Select candle time', ('day', 'week', 'month'))
+        candles_selection = st.selectbox('Select candle time', ('day', 'week', 'month', 'quarter'))
         tickers_selection = sorted(tickers_selection)
         number = st.number_input('Insert a number of days for the window', min_value=10, max_value=1000, value=250,
                                  step=10)
         number = int(number)
+        # bars of all tickers in one pass, cached by tickers, date range and frequency
+        with tracing.span('resample candles', rows=prices.size):
+            df_candles = resampling.resample_ohlc(prices, tickers_selection, candles_selection)
+        # drawdowns of all tickers at once
+        with tracing.span('drawdowns', rows=adj_close.size):
+            drawdowns = drawdown.compute_drawdowns(prices.frame('Adj Close', tickers_selection),
+                                                   window=number)
         for i in range(len(tickers_selection)):
 
-            df_ticker = df.loc[:, df.columns.str.contains(tickers_selection[i]) | df.columns.str.contains(
-                'Date') | df.columns.str.contains('Open') | df.columns.str.contains('High') | df.columns.str.contains(
-                'Close') | df.columns.str.contains('Low')]
-            df_ticker.columns = [x.replace(tickers_selection[i], '') for x in df_ticker.columns]
-            if candles_selection == 'day':
-                fig = go.Figure(data=[go.Candlestick(x=df_ticker['Date'],
+            with tracing.span('candlestick chart') as chart:
+                df_ticker = df_candles.xs(tickers_selection[i], axis=1, level=1).dropna(how='all')
+                chart.rows = len(df_ticker)
+                fig = go.Figure(data=[go.Candlestick(x=df_ticker.index,
                                                      open=df_ticker['Open'], high=df_ticker['High'],
                                                      low=df_ticker['Low'], close=df_ticker['Close'])])
-
-                fig.update_layout(xaxis_rangeslider_visible=False, width=1400, height=400,
-                                  title_text=f'{tickers_selection[i]} candlestick {candles_selection} chart')
-                st.plotly_chart(fig)
-            elif candles_selection == 'month':
-                df_ticker['month'] = df_ticker['Date'].apply(lambda dt: dt.replace(day=1))
-                df_ticker = df_ticker.sort_values(by='Date')
-                df_month = df_ticker.groupby('month').agg(
-                    {'Open': 'first', 'Close': 'last', 'High': 'max', 'Low': 'min'}).reset_index()
-                df_month.columns = ['month', 'Open', 'Close', 'High', 'Low']
-                fig = go.Figure(data=[go.Candlestick(x=df_month['month'],
-                                                     open=df_month['Open'], high=df_month['High'],
-                                                     low=df_month['Low'], close=df_month['Close'])])
-                fig.update_layout(xaxis_rangeslider_visible=False, width=1400, height=400,
-                                  title_text=f'{tickers_selection[i]} candlestick {candles_selection} chart')
-                st.plotly_chart(fig)
-            else:
-                df_ticker = df_ticker.sort_values(by='Date')
-                df_week = df_ticker.groupby(pd.Grouper(key='Date', freq="1W")).agg(
-                    {'Open': 'first', 'Close': 'last', 'High': 'max', 'Low': 'min'}).reset_index()
-                df_week.columns = ['week', 'Open', 'Close', 'High', 'Low']
-                fig = go.Figure(data=[go.Candlestick(x=df_week['week'],
-                                                     open=df_week['Open'], high=df_week['High'],
-                                                     low=df_week['Low'], close=df_week['Close'])])
                 fig.update_layout(xaxis_rangeslider_visible=False, width=1400, height=400,
                                   title_text=f'{tickers_selection[i]} candlestick {candles_selection} chart')
                 st.plotly_chart(fig)
@@ -145,18 +143,23 @@ def app(tickers):
     #     number = st.number_input('Insert a number of days for the window', min_value=10, max_value=1000, value=250,
     #                              step=10)
     #     number = int(number)
-            df_drawdown = df.loc[:, df.columns.str.contains('Adj Close') | df.columns.str.contains('Date')].set_index(
-            'Date')
-            df_drawdown = df_drawdown.reindex(sorted(df.columns), axis=1)
-            roll_max = df_drawdown.rolling(center=False, min_periods=1, window=number).max()
-            daily_draw_down = df_drawdown / roll_max - 1.0
-            max_daily_draw_down = daily_draw_down.rolling(center=False, min_periods=1, window=number).min()
-        #for i in range(len(tickers_selection)):
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=daily_draw_down.index, y=daily_draw_down.iloc[:, i], name="Daily"))
-            fig.add_trace(go.Scatter(x=max_daily_draw_down.index, y=max_daily_draw_down.iloc[:, i],
-                                     name="Max"))
-            fig.update_layout(barmode='overlay', width=1400, height=400,
-                              title=f'{daily_draw_down.columns[i].replace("Adj Close", "")} max drop-down chart ')
-            fig.update_traces(opacity=0.75)
-            st.plotly_chart(fig)
\ No newline at end of file
+            with tracing.span('drawdown chart', rows=len(drawdowns.index)):
+                fig = go.Figure()
+                for line_trace in decimation.line_traces({'Daily': drawdowns.drawdown.iloc[:, i],
+                                                     'Max': drawdowns.max_drawdown.iloc[:, i]},
+                                                    f'{tickers_selection[i]} drawdown', point_budget):
+                    fig.add_trace(line_trace)
+                fig.update_layout(barmode='overlay', width=1400, height=400,
+                                  title=f'{tickers_selection[i]} max drop-down chart ')
+                fig.update_traces(opacity=0.75)
+                st.plotly_chart(fig)
+
+        # deepest drawdown, its duration and recovery time in the window
+        with tracing.span('drawdown summary', rows=len(tickers_selection)):
+            st.dataframe(drawdowns.summary(), width=1500)
+
+    tracing.finish_trace(trace)
+    if st.session_state['analytics_debug_info'] == True:
+        debug_panel.show_trace(trace)
+        # price arrays shared by all sessions of this server
+        st.write(shared_prices.get_cache().stats())
@@ -0,0 +1,166 @@
+#######################
+# Imports
+#######################
+import numpy as np
+import pandas as pd
+import cvxpy as cp
+
+from pypfopt.exceptions import OptimizationError
+
+import frontier
+import options
+import drawdown
+import pipeline
+
+#######################
+# Configs
+#######################
+TRADING_DAYS = 252
+
+# rebalancing frequencies -> pandas period aliases
+REBALANCE_FREQUENCIES = options.REBALANCE_FREQUENCIES
+
+
+# ================================================
+# window statistics with rank-1 updates
+# ================================================
+
+class RollingMoments:
+    # mean, covariance and log-return sum of a window of daily returns,
+    # add() and remove() are O(k^2) rank-1 updates instead of a full sample_cov
+
+    def __init__(self, n_assets):
+        self.n = 0
+        self.mean = np.zeros(n_assets)
+        self.m2 = np.zeros((n_assets, n_assets))
+        self.log_sum = np.zeros(n_assets)
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += np.outer(delta, x - self.mean)
+        self.log_sum += np.log1p(x)
+
+    def remove(self, x):
+        if self.n == 1:
+            self.__init__(len(self.mean))
+            return
+        mean = self.mean - (x - self.mean) / (self.n - 1)
+        self.m2 -= np.outer(x - mean, x - self.mean)
+        self.mean = mean
+        self.n -= 1
+        self.log_sum -= np.log1p(x)
+
+    def expected_returns(self, frequency=TRADING_DAYS):
+        # same as expected_returns.mean_historical_return (compounded) on the window
+        return np.expm1(self.log_sum / self.n * frequency)
+
+    def covariance(self, frequency=TRADING_DAYS):
+        # same as risk_models.sample_cov on the window
+        return self.m2 / (self.n - 1) * frequency
+
+
+# ================================================
+# walk-forward backtest
+# ================================================
+
+def _rebalance_rows(dates, rebalance, first_row):
+    # first trading day of every period once the first estimation window is full
+    codes = dates.to_period(REBALANCE_FREQUENCIES.get(rebalance, rebalance)).asi8
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    starts = starts[starts > first_row]
+    return set(np.r_[first_row, starts].tolist())
+
+
+def walk_forward(prices,
+                 target='Max Sharpe',
+                 window=TRADING_DAYS,
+                 expanding=False,
+                 rebalance='month',
+                 risk_free_rate=0.02,
+                 target_volatility=0.02,
+                 target_return=0.02,
+                 frontier_points=10,
+                 frequency=TRADING_DAYS):
+    # prices: adjusted closes, one column per ticker
+    # weights are chosen on the estimation window before every rebalance day
+    # and held (drifting with prices) until the next one
+    returns = prices.pct_change().dropna(how='any')
+    values = returns.to_numpy(dtype=float)
+    dates = returns.index
+    tickers = list(returns.columns)
+    n_days, n_assets = values.shape
+    if n_days <= window:
+        raise ValueError(f'Need more than {window} days of returns for the backtest, got {n_days}')
+
+    rebalance_rows = _rebalance_rows(dates, rebalance, window)
+    moments = RollingMoments(n_assets)
+
+    # one frontier for the whole run, every rebalance only updates its parameters
+    ef_frontier = None
+    weights = np.zeros(n_assets)
+    portfolio_returns = np.full(n_days, np.nan)
+    rebalance_dates, target_weights, turnover, failures = [], [], [], []
+
+    for i in range(n_days):
+        if i in rebalance_rows:
+            mu = pd.Series(moments.expected_returns(frequency), index=tickers)
+            Sigma = pd.DataFrame(moments.covariance(frequency), index=tickers, columns=tickers)
+            try:
+                if ef_frontier is None:
+                    ef_frontier = frontier.Frontier(mu, Sigma, points=frontier_points)
+                else:
+                    ef_frontier.update(mu, Sigma)
+            except (ValueError, OptimizationError, cp.SolverError) as e:
+                # no frontier on this window (ill-conditioned): keep the current weights,
+                # the next rebalance builds a new frontier
+                ef_frontier = None
+                failures.append((dates[i], str(e)))
+                new_weights = weights
+            else:
+                try:
+                    new_weights = pipeline.solve_target(ef_frontier, target, risk_free_rate,
+                                                        target_volatility, target_return)
+                except (ValueError, OptimizationError, cp.SolverError) as e:
+                    # target not reachable on this window: stay at minimum volatility
+                    new_weights = ef_frontier.min_volatility()
+                    failures.append((dates[i], str(e)))
+                new_weights = np.array([new_weights[t] for t in tickers])
+
+            rebalance_dates.append(dates[i])
+            target_weights.append(new_weights)
+            turnover.append(np.abs(new_weights - weights).sum())
+            weights = new_weights
+
+        if i >= window:
+            # out of sample: the return of day i was not in the window used for the weights
+            portfolio_returns[i] = weights @ values[i]
+            # weights drift with prices until the next rebalance
+            grown = weights * (1 + values[i])
+            weights = grown / grown.sum()
+
+        moments.add(values[i])
+        if not expanding and moments.n > window:
+            moments.remove(values[i - window])
+
+    portfolio_returns = pd.Series(portfolio_returns, index=dates, name='return').iloc[window:]
+    equity = (1 + portfolio_returns).cumprod().rename('equity')
+    max_drawdown = drawdown.compute_drawdowns(equity.to_frame()).summary()['max drawdown'].iloc[0]
+
+    annual_return = np.expm1(np.log1p(portfolio_returns).mean() * frequency)
+    annual_volatility = portfolio_returns.std() * np.sqrt(frequency)
+    turnover = pd.Series(turnover, index=pd.DatetimeIndex(rebalance_dates, name='Date'), name='turnover')
+
+    return {'returns': portfolio_returns,
+            'equity': equity,
+            'weights': pd.DataFrame(target_weights, index=turnover.index, columns=tickers),
+            'turnover': turnover,
+            'failures': failures,
+            'summary': {'annual_return': annual_return,
+                        'annual_volatility': annual_volatility,
+                        'sharpe_ratio': (annual_return - risk_free_rate) / annual_volatility,
+                        'max_drawdown': max_drawdown,
+                        # the first rebalance buys from cash and is not counted
+                        'average_turnover': turnover.iloc[1:].mean(),
+                        'rebalances': len(turnover)}}
@@ -0,0 +1,287 @@
+#######################
+# Imports
+#######################
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import cvxpy
+import pypfopt
+from pypfopt import expected_returns
+from pypfopt import risk_models
+from pypfopt.discrete_allocation import DiscreteAllocation, get_latest_prices
+
+import providers
+import return_stats
+import resampling
+import drawdown
+import frontier
+import pipeline
+
+#######################
+# Configs
+#######################
+TICKERS = [10, 100, 500]
+YEARS = [5, 20]
+
+# bars per business day
+BAR_FREQUENCIES = {'day': 1,
+                   'hour': 7}
+
+# the optimization stages use at most this many tickers of the panel
+OPTIMIZE_TICKERS = 100
+
+# fixed last day so that every run sees the same panels
+END = '2022-12-30'
+
+
+# ================================================
+# synthetic price panels
+# ================================================
+
+def synthetic_panel(n_tickers, years, bar_frequency='day', seed=0):
+    # (field, ticker) frame like price_store.load_prices,
+    # intraday bars are the provider's daily paths put on an hourly clock
+    bars_per_day = BAR_FREQUENCIES[bar_frequency]
+    provider = providers.SyntheticProvider(n_tickers, years * bars_per_day, seed=seed, end=END)
+    frames, _ = provider.history(provider.tickers)
+    prices = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+    if bars_per_day > 1:
+        days = pd.bdate_range(end=END, periods=len(prices) // bars_per_day + 1)
+        hours = pd.to_timedelta(np.arange(bars_per_day) + 10, unit='h')
+        clock = (days.values[:, None] + hours.values[None, :]).ravel()[-len(prices):]
+        prices.index = pd.DatetimeIndex(clock, name='Date')
+    return prices
+
+
+# ================================================
+# stages
+# ================================================
+# every stage takes the state of the earlier stages and returns its own output,
+# the analytics stages mirror analytics.app and the optimization ones pipeline.optimize
+
+def _distribution_table(state):
+    return return_stats.distribution_table(return_stats.daily_returns(state['adj_close']))
+
+
+def _streaming_distribution_table(state):
+    # the accumulators are cached, time a full pass
+    return_stats.clear_cache()
+    return return_stats.streaming_distribution_table(return_stats.daily_returns(state['adj_close']))
+
+
+def _cumulative_returns(state):
+    return return_stats.cumulative_returns(state['adj_close'])
+
+
+def _resample_ohlc(state):
+    # a cache hit would only time the lookup
+    resampling.clear_cache()
+    return resampling.resample_ohlc(state['prices'], state['tickers'], 'week')
+
+
+def _drawdowns(state):
+    return drawdown.compute_drawdowns(state['adj_close'], window=250)
+
+
+def _mu_sigma(state):
+    prices = state['optimize_prices']
+    return expected_returns.mean_historical_return(prices), risk_models.sample_cov(prices)
+
+
+def _frontier(state):
+    mu, Sigma = state['mu_sigma']
+    return frontier.Frontier(mu, Sigma, points=state['points'])
+
+
+def _frontier_plot(state):
+    fig, ax = plt.subplots(figsize=(4, 4))
+    state['frontier'].plot(ax=ax, show_assets=True)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def _target(state):
+    # targets are memoized on the frontier, time the solve
+    state['frontier']._refined.clear()
+    return pipeline.solve_target(state['frontier'], 'Max Sharpe')
+
+
+def _lp_portfolio(state):
+    latest_prices = get_latest_prices(state['optimize_prices'])
+    da = DiscreteAllocation(state['target'], latest_prices, total_portfolio_value=20000)
+    return da.lp_portfolio()
+
+
+STAGES = [('analytics', 'distribution_table', _distribution_table),
+          ('analytics', 'streaming_distribution_table', _streaming_distribution_table),
+          ('analytics', 'cumulative_returns', _cumulative_returns),
+          ('analytics', 'resample_ohlc', _resample_ohlc),
+          ('analytics', 'drawdowns', _drawdowns),
+          ('optimization', 'mu_sigma', _mu_sigma),
+          ('optimization', 'frontier', _frontier),
+          ('optimization', 'frontier_plot', _frontier_plot),
+          ('optimization', 'target', _target),
+          ('optimization', 'lp_portfolio', _lp_portfolio)]
+
+
+# ================================================
+# measuring
+# ================================================
+
+def measure(func, repeats=3, memory=True):
+    # wall times of `repeats` plain runs, then one run under tracemalloc for the peak
+    # (numpy reports its buffers to tracemalloc, the traced run is not timed)
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - started)
+
+    peak = np.nan
+    if memory:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_case(n_tickers, years, bar_frequency, stages=None, repeats=3, memory=True,
+             optimize_tickers=OPTIMIZE_TICKERS, points=20, seed=0):
+    prices = synthetic_panel(n_tickers, years, bar_frequency, seed)
+    adj_close = prices['Adj Close']
+    state = {'prices': prices,
+             'adj_close': adj_close,
+             'tickers': list(adj_close.columns),
+             'optimize_prices': adj_close.iloc[:, :optimize_tickers],
+             'points': points}
+    case = {'tickers': n_tickers,
+            'years': years,
+            'bar_frequency': bar_frequency,
+            'bars': len(prices),
+            'optimized_tickers': state['optimize_prices'].shape[1]}
+
+    rows = []
+    for group, name, func in STAGES:
+        if stages and name not in stages:
+            continue
+        try:
+            state[name], seconds, peak = measure(lambda: func(state), repeats, memory)
+            error = None
+        except Exception as e:
+            # later stages that need this output fail as well and say so
+            seconds, peak, error = [np.nan], np.nan, f'{type(e).__name__}: {e}'
+        rows.append({**case,
+                     'group': group,
+                     'stage': name,
+                     'repeats': repeats,
+                     'best_seconds': float(np.min(seconds)),
+                     'median_seconds': float(np.median(seconds)),
+                     'peak_traced_mb': peak / 2**20,
+                     'error': error})
+    return rows
+
+
+# ================================================
+# results
+# ================================================
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'cvxpy': cvxpy.__version__,
+            'pypfopt': getattr(pypfopt, '__version__', None)}
+
+
+def compare(results, baseline, threshold=1.25):
+    # stages that got slower than threshold x their best time in the baseline
+    key = ['tickers', 'years', 'bar_frequency', 'stage']
+    new = pd.DataFrame(results['results']).set_index(key)['best_seconds']
+    old = pd.DataFrame(baseline['results']).set_index(key)['best_seconds']
+    ratio = (new / old).dropna().rename('ratio')
+    table = pd.concat([old.rename('baseline'), new.rename('current'), ratio], axis=1, join='inner')
+    return table[table['ratio'] > threshold]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the analytics and optimization stages on synthetic panels')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--tickers', type=int, nargs='+', default=TICKERS)
+    parser.add_argument('--years', type=float, nargs='+', default=YEARS)
+    parser.add_argument('--bar-frequencies', nargs='+', choices=list(BAR_FREQUENCIES), default=['day'])
+    parser.add_argument('--stages', nargs='+', choices=[name for _, name, _ in STAGES], default=None)
+    parser.add_argument('--optimize-tickers', type=int, default=OPTIMIZE_TICKERS)
+    parser.add_argument('--points', type=int, default=20, help='frontier points')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', default=None, help='earlier results file, exits with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    rows = []
+    for bar_frequency in args.bar_frequencies:
+        for years in args.years:
+            for n_tickers in args.tickers:
+                case_rows = run_case(n_tickers, years, bar_frequency,
+                                     stages=args.stages,
+                                     repeats=args.repeats,
+                                     memory=not args.no_memory,
+                                     optimize_tickers=args.optimize_tickers,
+                                     points=args.points,
+                                     seed=args.seed)
+                for row in case_rows:
+                    print(f"{row['bar_frequency']:>5} {row['years']:>5g}y {row['tickers']:>6} tickers "
+                          f"{row['stage']:<20} {row['best_seconds']:10.4f}s {row['peak_traced_mb']:10.1f}MB"
+                          + (f"  {row['error']}" if row['error'] else ''))
+                rows.extend(case_rows)
+
+    results = {'meta': {'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+                        'commit': _git_commit(),
+                        'platform': platform.platform(),
+                        'machine': platform.machine(),
+                        'versions': _versions(),
+                        'repeats': args.repeats,
+                        # whole process, includes panel generation
+                        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10},
+               'results': rows}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'{len(rows)} measurements -> {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if not regressions.empty:
+            print(f'slower than {args.threshold}x the baseline:')
+            print(regressions.to_string())
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#######################
+# Imports
+#######################
+import os
+
+import numpy as np
+import pandas as pd
+
+#######################
+# Configs
+#######################
+TRADING_DAYS = 252
+
+# working memory for the return blocks and their products, bytes
+# (the resulting N x N matrix is not counted)
+MEMORY_BUDGET = int(os.environ.get('COVARIANCE_MEMORY_BUDGET', 256 * 2**20))
+
+METHODS = ['chunked_sample_cov',
+           'chunked_ledoit_wolf',
+           'pca_factor']
+
+# pypfopt's risk models plus the memory-bounded ones for big universes,
+# here so that the pages can list them without importing pypfopt
+RISK_MODELS = ['sample_cov',
+               'exp_cov',
+               'ledoit_wolf'] + METHODS
+
+
+# ================================================
+# returns in column blocks
+# ================================================
+
+def block_size(n_rows, n_columns, itemsize, memory_budget=MEMORY_BUDGET):
+    # columns per block so that two (rows x block) return/mask pairs
+    # and four (block x block) products fit into the budget
+    budget = memory_budget / itemsize
+    size = int((-4 * n_rows + np.sqrt(16 * n_rows ** 2 + 16 * budget)) / 8)
+    return int(np.clip(size, 1, n_columns))
+
+
+def _blocks(n_columns, size):
+    return [slice(start, min(start + size, n_columns)) for start in range(0, n_columns, size)]
+
+
+def _returns_block(prices, columns, dtype):
+    # same returns as pypfopt (prices.pct_change()), first row dropped
+    return prices.iloc[:, columns].pct_change().to_numpy(dtype=dtype)[1:]
+
+
+def _column_moments(prices, blocks, dtype):
+    # mean and variance of every column over its own observations
+    means, variances = [], []
+    for columns in blocks:
+        returns = _returns_block(prices, columns, dtype)
+        means.append(np.nanmean(returns, axis=0))
+        variances.append(np.nanvar(returns, axis=0, ddof=1))
+    return np.concatenate(means), np.concatenate(variances)
+
+
+# ================================================
+# pairwise sample covariance and Ledoit-Wolf shrinkage
+# ================================================
+
+def _pairwise_cov(prices, dtype, frequency, memory_budget, shrinkage_stats=False):
+    n_rows, n_columns = len(prices) - 1, prices.shape[1]
+    itemsize = np.dtype(dtype).itemsize
+    blocks = _blocks(n_columns, block_size(n_rows, n_columns, itemsize, memory_budget))
+
+    # the only N x N allocation
+    cov = np.empty((n_columns, n_columns), dtype=dtype)
+
+    if shrinkage_stats:
+        means, _ = _column_moments(prices, blocks, dtype)
+        row_norms = np.zeros(n_rows, dtype=np.float64)
+        gram_norm = 0.0
+
+    for i, columns_i in enumerate(blocks):
+        x_i = _returns_block(prices, columns_i, dtype)
+        m_i = ~np.isnan(x_i)
+        x_i = np.nan_to_num(x_i, copy=False)
+        ones_i = m_i.astype(dtype)
+        if shrinkage_stats:
+            centered_i = np.where(m_i, x_i - means[columns_i], 0).astype(dtype, copy=False)
+            row_norms += np.sum(centered_i.astype(np.float64) ** 2, axis=1)
+
+        for columns_j in blocks[i:]:
+            if columns_j == columns_i:
+                x_j, ones_j = x_i, ones_i
+            else:
+                x_j = _returns_block(prices, columns_j, dtype)
+                ones_j = (~np.isnan(x_j)).astype(dtype)
+                x_j = np.nan_to_num(x_j, copy=False)
+
+            # pandas' pairwise formula: every pair uses the rows where both have data
+            count = ones_i.T @ ones_j
+            sum_i = x_i.T @ ones_j
+            sum_j = ones_i.T @ x_j
+            with np.errstate(invalid='ignore', divide='ignore'):
+                block = (x_i.T @ x_j - sum_i * sum_j / count) / (count - 1)
+            # no overlap at all: treat as uncorrelated rather than NaN
+            block[~np.isfinite(block)] = 0
+            block *= frequency
+            cov[columns_i, columns_j] = block
+            cov[columns_j, columns_i] = block.T
+
+            if shrinkage_stats:
+                if columns_j == columns_i:
+                    centered_j = centered_i
+                else:
+                    centered_j = np.where(ones_j > 0, x_j - means[columns_j], 0).astype(dtype, copy=False)
+                gram = (centered_i.T @ centered_j).astype(np.float64)
+                # off-diagonal blocks appear twice in the full Gram matrix
+                gram_norm += np.sum(gram ** 2) * (1 if columns_j == columns_i else 2)
+
+    if not shrinkage_stats:
+        return cov, None
+    return cov, (row_norms, gram_norm, n_rows)
+
+
+def chunked_sample_cov(prices, dtype=np.float64, frequency=TRADING_DAYS, memory_budget=MEMORY_BUDGET):
+    # same as risk_models.sample_cov (pairwise over the overlapping history),
+    # built block by block in dtype (np.float32 halves the memory)
+    cov, _ = _pairwise_cov(prices, dtype, frequency, memory_budget)
+    return cov
+
+
+def chunked_ledoit_wolf(prices, dtype=np.float64, frequency=TRADING_DAYS, memory_budget=MEMORY_BUDGET):
+    # Ledoit-Wolf shrinkage towards a scaled identity (as sklearn / pypfopt's ledoit_wolf),
+    # the shrinkage intensity is estimated on the centered, zero-filled returns
+    # and applied in place to the pairwise sample covariance
+    cov, (row_norms, gram_norm, n) = _pairwise_cov(prices, dtype, frequency, memory_budget,
+                                                   shrinkage_stats=True)
+    p = cov.shape[0]
+
+    emp_trace = row_norms.sum() / n
+    mu = emp_trace / p
+    delta_ = gram_norm / n ** 2
+    beta_ = np.sum(row_norms ** 2)
+    beta = (beta_ / n - delta_) / (p * n)
+    delta = (delta_ - 2 * mu * emp_trace + p * mu ** 2) / p
+    beta = min(beta, delta)
+    shrinkage = 0.0 if beta == 0 else beta / delta
+
+    target = np.trace(cov) / p
+    cov *= (1 - shrinkage)
+    cov.flat[::p + 1] += shrinkage * target
+    return cov
+
+
+# ================================================
+# statistical factor model (PCA)
+# ================================================
+
+class FactorCovariance:
+    # Sigma = loadings @ loadings.T + diag(specific), never stored densely
+
+    def __init__(self, loadings, specific, tickers):
+        self.loadings = loadings
+        self.specific = specific
+        self.tickers = list(tickers)
+
+    @property
+    def shape(self):
+        return (len(self.tickers), len(self.tickers))
+
+    def variances(self, weights):
+        # w' Sigma w for every row of weights
+        weights = np.atleast_2d(weights)
+        return np.sum((weights @ self.loadings) ** 2, axis=1) + (weights ** 2) @ self.specific
+
+    def to_frame(self):
+        cov = self.loadings @ self.loadings.T
+        cov.flat[::len(self.tickers) + 1] += self.specific
+        return pd.DataFrame(cov, index=self.tickers, columns=self.tickers)
+
+
+def risk_root(Sigma, tickers=None):
+    # (root, specific) with Sigma = root @ root.T + diag(specific), restricted to tickers,
+    # for a dense matrix (eigh also copes with a singular or slightly indefinite
+    # pairwise covariance) or a FactorCovariance
+    if isinstance(Sigma, FactorCovariance):
+        loadings = np.asarray(Sigma.loadings, dtype=float)
+        specific = np.asarray(Sigma.specific, dtype=float)
+        if tickers is None:
+            return loadings, specific
+        rows = pd.Index(Sigma.tickers).get_indexer(tickers)
+        return loadings[rows], specific[rows]
+    if tickers is not None:
+        Sigma = pd.DataFrame(Sigma).reindex(index=tickers, columns=tickers)
+    cov = np.asarray(Sigma, dtype=float)
+    eigenvalues, eigenvectors = np.linalg.eigh((cov + cov.T) / 2)
+    return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None)), np.zeros(len(cov))
+
+
+def pca_factor(prices, n_factors=10, dtype=np.float64, frequency=TRADING_DAYS,
+               memory_budget=MEMORY_BUDGET, power_iterations=2, seed=0):
+    # top principal components of the centered, zero-filled returns by a randomized
+    # range finder that only ever multiplies return blocks with thin matrices,
+    # the rest of every asset's variance (over its own history) is specific
+    n_rows, n_columns = len(prices) - 1, prices.shape[1]
+    itemsize = np.dtype(dtype).itemsize
+    blocks = _blocks(n_columns, block_size(n_rows, n_columns, itemsize, memory_budget))
+    means, variances = _column_moments(prices, blocks, dtype)
+    n_factors = min(n_factors, n_columns, n_rows)
+
+    def centered(columns):
+        returns = _returns_block(prices, columns, dtype)
+        return np.nan_to_num(returns - means[columns], copy=False)
+
+    def times(matrix):
+        # X @ matrix, matrix is (columns x k)
+        return sum(centered(columns) @ matrix[columns] for columns in blocks)
+
+    def transposed_times(matrix):
+        # X.T @ matrix, matrix is (rows x k)
+        return np.vstack([centered(columns).T @ matrix for columns in blocks])
+
+    rng = np.random.default_rng(seed)
+    sketch = times(rng.standard_normal((n_columns, n_factors + 10)).astype(dtype))
+    for _ in range(power_iterations):
+        sketch, _ = np.linalg.qr(sketch)
+        sketch = times(transposed_times(sketch))
+    basis, _ = np.linalg.qr(sketch)
+
+    # small SVD of basis.T @ X gives the right singular vectors of X
+    _, singular_values, components = np.linalg.svd(transposed_times(basis).T, full_matrices=False)
+    singular_values, components = singular_values[:n_factors], components[:n_factors]
+
+    loadings = components.T * (singular_values * np.sqrt(frequency / (n_rows - 1)))
+    common = np.sum(loadings ** 2, axis=1)
+    total = np.nan_to_num(variances) * frequency
+    # a small floor keeps every asset's variance positive
+    specific = np.maximum(total - common, 1e-4 * total + 1e-12)
+    return FactorCovariance(loadings.astype(dtype, copy=False), specific.astype(dtype, copy=False),
+                            prices.columns)
+
+
+# ================================================
+# entry point used by risk_cache
+# ================================================
+
+def risk_matrix(prices, method='chunked_ledoit_wolf', dtype=np.float64, **kwargs):
+    if method == 'pca_factor':
+        return pca_factor(prices, dtype=dtype, **kwargs)
+    elif method == 'chunked_sample_cov':
+        cov = chunked_sample_cov(prices, dtype=dtype, **kwargs)
+    elif method == 'chunked_ledoit_wolf':
+        cov = chunked_ledoit_wolf(prices, dtype=dtype, **kwargs)
+    else:
+        raise ValueError(f'Unknown risk model: {method}')
+    # wraps the array, no copy
+    return pd.DataFrame(cov, index=prices.columns, columns=prices.columns, copy=False)
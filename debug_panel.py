@@ -0,0 +1,54 @@
+#######################
+# Imports
+#######################
+import streamlit as st
+import pandas as pd
+import plotly.graph_objects as go
+
+import tracing
+
+
+# ================================================
+# span waterfall of one trace
+# ================================================
+
+def waterfall_figure(trace):
+    spans = trace.to_frame()
+    # nested spans are indented under their parent, first span on top
+    labels = [f'{"  " * depth}{name} #{i}' for i, (name, depth) in enumerate(zip(spans['name'], spans['depth']))]
+    hover = [f'{name}<br>{seconds * 1000:.1f} ms'
+             + (f'<br>{int(rows):,} rows' if pd.notna(rows) else '')
+             + (f'<br>{allocated / 2**20:.1f} MB allocated' if pd.notna(allocated) else '')
+             for name, seconds, rows, allocated in zip(spans['name'], spans['seconds'].fillna(0),
+                                                       spans['rows'], spans['allocated_bytes'])]
+    fig = go.Figure(go.Bar(y=labels,
+                           x=spans['seconds'].fillna(0) * 1000,
+                           base=spans['start'] * 1000,
+                           orientation='h',
+                           hovertext=hover,
+                           hoverinfo='text',
+                           marker_color=spans['depth'],
+                           marker_colorscale='Blues_r'))
+    fig.update_layout(width=1400, height=120 + 24 * len(spans),
+                      title_text=f'{trace.name}: {(trace.seconds or 0) * 1000:.0f} ms',
+                      xaxis_title='ms since the start of the run',
+                      yaxis_autorange='reversed',
+                      margin=dict(l=250))
+    return fig
+
+
+def show_trace(trace):
+    st.title('Timings')
+    st.plotly_chart(waterfall_figure(trace))
+    st.dataframe(trace.to_frame(), width=1500)
+
+    # same data for offline analysis, the prometheus counters cover the whole process
+    c1, c2, _, _ = st.columns(4)
+    c1.download_button('Spans as JSON lines',
+                       tracing.to_jsonl([trace]),
+                       file_name=f'{trace.name}_{trace.id}.jsonl',
+                       key=f'download_jsonl_{trace.name}')
+    c2.download_button('Metrics as Prometheus text',
+                       tracing.prometheus_text(),
+                       file_name='metrics.prom',
+                       key=f'download_prometheus_{trace.name}')
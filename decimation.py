@@ -0,0 +1,134 @@
+#######################
+# Imports
+#######################
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+#######################
+# Configs
+#######################
+# points kept per line, 0 sends everything
+POINT_BUDGET = int(os.environ.get('CHART_POINT_BUDGET', 2000))
+
+# a figure with more points than this is drawn with WebGL (go.Scattergl)
+WEBGL_THRESHOLD = 10000
+
+METHODS = ['minmax', 'lttb']
+
+# how many decimated lines are kept
+CACHE_SIZE = 256
+
+_cache = OrderedDict()
+
+
+# ================================================
+# decimation of one line
+# ================================================
+# both methods return sorted positions into the line,
+# the first and last point and the global min and max are always kept
+
+def _always_kept(values):
+    kept = [0, len(values) - 1]
+    if np.isfinite(values).any():
+        kept += [int(np.nanargmin(values)), int(np.nanargmax(values))]
+    return np.array(kept)
+
+
+def minmax_positions(values, budget):
+    # min and max of every bucket of consecutive points: keeps every peak and trough
+    # (drawdown troughs included), fully vectorized over the buckets
+    n = len(values)
+    buckets = max(budget // 2, 1)
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    # an all-NaN bucket keeps its first point, so a gap in the data stays a gap
+    lows = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1) + offsets
+    highs = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1) + offsets
+    positions = np.concatenate([lows, highs, _always_kept(values)])
+    return np.unique(positions[positions < n])
+
+
+def lttb_positions(values, budget):
+    # largest triangle three buckets on the valid points: the visually most
+    # important point of every bucket
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) <= budget:
+        return valid
+    x = valid.astype(float)
+    y = values[valid]
+
+    edges = np.linspace(1, len(valid) - 1, budget - 1).astype(int)
+    selected = [0]
+    for i in range(len(edges) - 1):
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        # mean of the next bucket is the third corner
+        next_stop = edges[i + 2] if i + 2 < len(edges) else len(valid)
+        next_x = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        next_y = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+        a = selected[-1]
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        selected.append(start + int(np.argmax(areas)))
+    selected.append(len(valid) - 1)
+    positions = np.concatenate([valid[selected], valid[_always_kept(y)]])
+    return np.unique(positions)
+
+
+def decimate(series, budget=POINT_BUDGET, method='minmax'):
+    # at most about budget points of a line (a few more for the kept extremes)
+    if not budget or len(series) <= budget:
+        return series
+    values = series.to_numpy(dtype=float)
+    if method == 'minmax':
+        positions = minmax_positions(values, budget)
+    elif method == 'lttb':
+        positions = lttb_positions(values, budget)
+    else:
+        raise ValueError(f'Unknown decimation method: {method}')
+    return series.iloc[positions]
+
+
+def cached_decimate(series, kind, budget=POINT_BUDGET, method='minmax'):
+    # kind tells apart lines of the same ticker and range (cumulative return, drawdown, ...),
+    # the content hash any other change of the line (a refresh, a rescaled adjusted history,
+    # another drawdown window)
+    if len(series) == 0:
+        return series
+    digest = hashlib.sha1(pd.util.hash_pandas_object(series, index=True).to_numpy().tobytes()).hexdigest()
+    key = (kind, series.name, budget, method, digest)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    line = decimate(series, budget, method)
+    _cache[key] = line
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return line
+
+
+def clear_cache():
+    _cache.clear()
+
+
+# ================================================
+# plotly traces
+# ================================================
+
+def line_traces(lines, kind, budget=POINT_BUDGET, method='minmax', **trace_kwargs):
+    # lines: {trace name: series}, one go.Scatter per line,
+    # go.Scattergl if the figure would get more than WEBGL_THRESHOLD points
+    decimated = {name: cached_decimate(series.rename(name), kind, budget, method)
+                 for name, series in lines.items()}
+    trace_type = go.Scattergl if sum(map(len, decimated.values())) > WEBGL_THRESHOLD else go.Scatter
+    return [trace_type(x=line.index, y=line.values, name=name, **trace_kwargs)
+            for name, line in decimated.items()]
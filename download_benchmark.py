@@ -0,0 +1,184 @@
+#######################
+# Imports
+#######################
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+import downloader
+import providers
+
+#######################
+# Configs
+#######################
+TICKERS = 200
+YEARS = 5
+
+# seconds every response of the stand-in server takes
+LATENCY = 0.05
+
+# share of tickers answered 503 on their first request (retried),
+# unknown to the server (404, not retried) and throttled once with Retry-After (429)
+FLAKY = 0.1
+MISSING = 0.05
+THROTTLED = 0.05
+
+
+# ================================================
+# stand-in for the chart API
+# ================================================
+
+def chart_payload(bars):
+    # daily bars -> chart API json, what downloader.parse_chart reads
+    timestamps = (bars.index.view(np.int64) // 10 ** 9).tolist()
+    quote = {column.lower(): bars[column].tolist() for column in ['Open', 'High', 'Low', 'Close', 'Volume']}
+    return {'chart': {'result': [{'meta': {'gmtoffset': 0},
+                                  'timestamp': timestamps,
+                                  'indicators': {'quote': [quote],
+                                                 'adjclose': [{'adjclose': bars['Adj Close'].tolist()}]}}],
+                      'error': None}}
+
+
+class StandInServer:
+    # synthetic provider bars over HTTP on localhost, with latency and scripted failures;
+    # counts the requests of every ticker and their times
+
+    def __init__(self, provider, latency=LATENCY, flaky=(), missing=(), throttled=()):
+        self.provider = provider
+        self.latency = latency
+        self.flaky = set(flaky)
+        self.missing = set(missing)
+        self.throttled = set(throttled)
+        self.requests = {}
+        self.times = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, body, headers = server.respond(self.path)
+                time.sleep(server.latency)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}'
+
+    def respond(self, path):
+        # (status, json body, headers) of one request
+        url = urllib.parse.urlparse(path)
+        ticker = url.path.rsplit('/', 1)[-1]
+        with self._lock:
+            attempt = self.requests.get(ticker, 0) + 1
+            self.requests[ticker] = attempt
+            self.times.append(time.monotonic())
+
+        if ticker in self.missing:
+            return 404, {'chart': {'result': None,
+                                   'error': {'code': 'Not Found',
+                                             'description': 'No data found, symbol may be delisted'}}}, {}
+        if ticker in self.flaky and attempt == 1:
+            return 503, {}, {}
+        if ticker in self.throttled and attempt == 1:
+            return 429, {}, {'Retry-After': '1'}
+
+        period1 = int(urllib.parse.parse_qs(url.query).get('period1', [0])[0])
+        bars = self.provider.bars(ticker)
+        bars = bars[bars.index >= pd.Timestamp(period1, unit='s')]
+        return 200, chart_payload(bars), {}
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ================================================
+# one run of fetch_many against the stand-in
+# ================================================
+
+def run(n_tickers=TICKERS, years=YEARS, latency=LATENCY, workers=downloader.WORKERS,
+        rate_limit=downloader.RATE_LIMIT, flaky=FLAKY, missing=MISSING, throttled=THROTTLED, seed=0):
+    # returns {'seconds', 'tickers_per_second', 'checks' ({name: passed})}
+    provider = providers.SyntheticProvider(n_tickers, years, seed=seed)
+    rng = np.random.default_rng(seed)
+    tickers = list(provider.tickers)
+    shuffled = list(rng.permutation(tickers))
+    n_flaky, n_missing, n_throttled = (int(share * n_tickers) for share in (flaky, missing, throttled))
+    flaky_tickers = shuffled[:n_flaky]
+    throttled_tickers = shuffled[n_flaky:n_flaky + n_throttled]
+    # unknown symbols: not in the provider, the server answers 404
+    missing_tickers = [f'MISSING{i}' for i in range(n_missing)]
+
+    with StandInServer(provider, latency, flaky_tickers, missing_tickers, throttled_tickers) as server:
+        started = time.monotonic()
+        frames, failures = downloader.fetch_many(tickers + missing_tickers, workers=workers,
+                                                 rate_limit=rate_limit, backoff=0.1, base_url=server.url)
+        seconds = time.monotonic() - started
+        times = np.sort(server.times)
+
+    expected = provider.bars(tickers[0])
+    got = frames.get(tickers[0])
+    checks = {
+        # every real ticker arrives, retried ones included
+        'all tickers downloaded': sorted(frames) == sorted(tickers),
+        'bars match the provider': got is not None and np.allclose(got['Adj Close'].to_numpy(),
+                                                                   expected['Adj Close'].to_numpy()),
+        'flaky tickers retried once': all(server.requests[t] == 2 for t in flaky_tickers),
+        'throttled tickers retried once': all(server.requests[t] == 2 for t in throttled_tickers),
+        # a 404 is final: reported after one attempt
+        'missing tickers reported': sorted(failures.index) == sorted(missing_tickers)
+                                    and bool((failures['attempts'] == 1).all()),
+        # n requests under the token bucket take at least (n - 1) / rate seconds
+        'rate limit respected': not rate_limit or times[-1] - times[0] >= (len(times) - 1) / rate_limit * 0.95,
+    }
+    return {'requests': len(times),
+            'seconds': seconds,
+            'tickers_per_second': n_tickers / seconds,
+            'checks': checks}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput and failure handling of downloader.fetch_many '
+                                                 'against a local stand-in of the chart API')
+    parser.add_argument('--tickers', type=int, default=TICKERS)
+    parser.add_argument('--years', type=float, default=YEARS)
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds per response')
+    parser.add_argument('--workers', type=int, default=downloader.WORKERS)
+    parser.add_argument('--rate-limit', type=float, default=downloader.RATE_LIMIT,
+                        help='requests per second, 0 to disable')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = run(args.tickers, args.years, args.latency, args.workers, args.rate_limit, seed=args.seed)
+    print(f'{args.tickers} tickers, {result["requests"]} requests in {result["seconds"]:.2f}s '
+          f'({result["tickers_per_second"]:.1f} tickers/s)')
+    for name, passed in result['checks'].items():
+        print(f'{"ok  " if passed else "FAIL"} {name}')
+    return 0 if all(result['checks'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
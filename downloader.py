@@ -0,0 +1,202 @@
+#######################
+# Imports
+#######################
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+#######################
+# Configs
+#######################
+# Yahoo chart API (the endpoint yfinance uses), can point to a local stand-in server
+CHART_URL = os.environ.get('PRICE_CHART_URL', 'https://query2.finance.yahoo.com/v8/finance/chart')
+
+WORKERS = 8
+# seconds for connecting and for every read of one request
+TIMEOUT = 10
+# extra attempts after the first one, with exponential backoff and jitter
+RETRIES = 3
+BACKOFF = 0.5
+# requests per second over all threads, None to disable
+RATE_LIMIT = float(os.environ.get('PRICE_RATE_LIMIT', 5))
+
+# yfinance's start for period='max'
+EARLIEST = -2208994789
+
+# worth another attempt: throttling and server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+FAILURE_COLUMNS = ['error', 'attempts', 'seconds']
+
+
+# ================================================
+# global rate limit
+# ================================================
+
+class RateLimiter:
+    # token bucket shared by all threads, the bucket may go negative:
+    # every caller reserves its slot under the lock and sleeps outside of it
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# ================================================
+# one ticker
+# ================================================
+
+class FetchError(Exception):
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# one keep-alive session per worker thread
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+        _local.session.headers['User-Agent'] = 'Mozilla/5.0'
+    return _local.session
+
+
+def parse_chart(payload):
+    # chart API json -> daily bars with price_store.FIELDS columns
+    chart = payload.get('chart') or {}
+    if chart.get('error'):
+        raise FetchError(chart['error'].get('description') or str(chart['error']))
+    result = (chart.get('result') or [None])[0]
+    if not result or not result.get('timestamp'):
+        return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'],
+                            index=pd.DatetimeIndex([], name='Date'), dtype=float)
+
+    # exchange-local calendar days, like yfinance
+    offset = result.get('meta', {}).get('gmtoffset') or 0
+    index = pd.to_datetime(np.asarray(result['timestamp']) + offset, unit='s').normalize()
+
+    quote = result['indicators']['quote'][0]
+    df = pd.DataFrame({'Open': quote.get('open'),
+                       'High': quote.get('high'),
+                       'Low': quote.get('low'),
+                       'Close': quote.get('close'),
+                       'Volume': quote.get('volume')},
+                      index=pd.DatetimeIndex(index, name='Date'), dtype=float)
+    adjclose = result['indicators'].get('adjclose')
+    df.insert(4, 'Adj Close', adjclose[0]['adjclose'] if adjclose else df['Close'])
+    df['Adj Close'] = df['Adj Close'].astype(float)
+    return df
+
+
+def fetch_chart(ticker, start=None, timeout=TIMEOUT, base_url=CHART_URL):
+    # full daily history or everything from start (inclusive)
+    period1 = EARLIEST if start is None else int(pd.Timestamp(start).timestamp())
+    params = {'period1': period1,
+              'period2': int(time.time()),
+              'interval': '1d',
+              'events': 'div,splits',
+              'includeAdjustedClose': 'true'}
+    try:
+        response = _session().get(f'{base_url}/{ticker}', params=params, timeout=timeout)
+    except (requests.Timeout, requests.ConnectionError) as e:
+        raise FetchError(f'{type(e).__name__}: {e}', retryable=True)
+
+    if response.status_code in RETRY_STATUS:
+        retry_after = response.headers.get('Retry-After')
+        raise FetchError(f'HTTP {response.status_code}', retryable=True,
+                         retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+    try:
+        payload = response.json()
+    except ValueError:
+        raise FetchError(f'HTTP {response.status_code}: not a chart response')
+    # unknown tickers come back as 404 with a chart error in the body
+    return parse_chart(payload)
+
+
+def _fetch_with_retries(ticker, start, fetch, limiter, retries, backoff):
+    started = time.monotonic()
+    for attempt in range(1, retries + 2):
+        limiter.acquire()
+        try:
+            return fetch(ticker, start), None
+        except FetchError as e:
+            error = e
+        except Exception as e:
+            # a bad payload of one ticker must not take down the batch
+            error = FetchError(f'{type(e).__name__}: {e}')
+        if not error.retryable or attempt > retries:
+            break
+        delay = error.retry_after or backoff * 2 ** (attempt - 1)
+        time.sleep(delay * random.uniform(0.5, 1.5))
+    return None, {'ticker': ticker,
+                  'error': str(error),
+                  'attempts': attempt,
+                  'seconds': time.monotonic() - started}
+
+
+# ================================================
+# many tickers
+# ================================================
+
+def failure_report(rows):
+    # one row per failed ticker
+    return pd.DataFrame(rows, columns=['ticker'] + FAILURE_COLUMNS).set_index('ticker')
+
+
+def fetch_many(tickers,
+               start=None,
+               workers=WORKERS,
+               timeout=TIMEOUT,
+               retries=RETRIES,
+               backoff=BACKOFF,
+               rate_limit=RATE_LIMIT,
+               base_url=CHART_URL,
+               fetch=None):
+    # start: one date for all tickers or {ticker: date}, None means full history
+    # fetch(ticker, start) -> DataFrame replaces the chart API call
+    # returns ({ticker: bars} of everything that succeeded, failure report)
+    if fetch is None:
+        def fetch(ticker, ticker_start):
+            return fetch_chart(ticker, ticker_start, timeout=timeout, base_url=base_url)
+    starts = start if isinstance(start, dict) else dict.fromkeys(tickers, start)
+    limiter = RateLimiter(rate_limit)
+
+    frames, failures = {}, []
+    if not tickers:
+        return frames, failure_report(failures)
+
+    def task(ticker):
+        return ticker, _fetch_with_retries(ticker, starts.get(ticker), fetch, limiter, retries, backoff)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(tickers))) as executor:
+        for ticker, (df, failure) in executor.map(task, tickers):
+            if failure is None:
+                frames[ticker] = df
+            else:
+                failures.append(failure)
+    return frames, failure_report(failures)
@@ -0,0 +1,138 @@
+#######################
+# Imports
+#######################
+import numpy as np
+import pandas as pd
+
+
+# ================================================
+# running / rolling extremes of a block of new bars
+# ================================================
+
+def _accumulate(func, previous, new):
+    # running max/min over the new rows continuing from the last previous result
+    return func.accumulate(np.vstack([previous, new]), axis=0)[1:]
+
+
+def _rolling(how, history, new, window):
+    # rolling max/min over the new rows, only the last window - 1 old rows are needed
+    tail = history[len(history) - (window - 1):] if window > 1 else history[:0]
+    frame = pd.DataFrame(np.vstack([tail, new]))
+    rolled = getattr(frame.rolling(window, min_periods=1), how)()
+    return rolled.to_numpy()[len(tail):]
+
+
+# ================================================
+# drawdowns of all tickers at once
+# ================================================
+
+class DrawdownTracker:
+    # peak, drawdown, max drawdown and drawdown duration of a (time x ticker) price block,
+    # window=None means running (all-time) peak, otherwise a rolling window of bars
+    # update() only processes the appended bars
+
+    def __init__(self, window=None):
+        self.window = window
+        self.index = pd.DatetimeIndex([], name='Date')
+        self.columns = None
+
+    def _init_arrays(self, n_tickers):
+        empty = np.empty((0, n_tickers))
+        self._prices = empty
+        self._peak = empty
+        self._drawdown = empty
+        self._max_drawdown = empty
+        self._duration = empty
+        # row of the last bar at the peak for every ticker
+        self._last_peak_row = np.full(n_tickers, -1)
+
+    def update(self, prices):
+        # prices are the new bars (time x ticker) after the last bar seen so far
+        if self.columns is None:
+            self.columns = prices.columns
+            self._init_arrays(len(self.columns))
+        new = prices.reindex(columns=self.columns).to_numpy(dtype=float)
+        if not len(new):
+            return self
+
+        n_old = len(self._prices)
+        n_tickers = len(self.columns)
+
+        if self.window is None:
+            previous = self._peak[-1:] if n_old else np.full((1, n_tickers), np.nan)
+            peak = _accumulate(np.fmax, previous, new)
+        else:
+            peak = _rolling('max', self._prices, new, self.window)
+        drawdown = new / peak - 1.0
+
+        if self.window is None:
+            previous = self._max_drawdown[-1:] if n_old else np.full((1, n_tickers), np.nan)
+            max_drawdown = _accumulate(np.fmin, previous, drawdown)
+        else:
+            max_drawdown = _rolling('min', self._drawdown, drawdown, self.window)
+
+        # bars since the last peak, missing bars count as being at the peak
+        rows = np.arange(n_old, n_old + len(new))[:, None]
+        at_peak = ~(drawdown < 0)
+        last_peak_row = _accumulate(np.maximum, self._last_peak_row[None, :], np.where(at_peak, rows, -1))
+        duration = rows - last_peak_row
+
+        self._prices = np.vstack([self._prices, new])
+        self._peak = np.vstack([self._peak, peak])
+        self._drawdown = np.vstack([self._drawdown, drawdown])
+        self._max_drawdown = np.vstack([self._max_drawdown, max_drawdown])
+        self._duration = np.vstack([self._duration, duration])
+        self._last_peak_row = last_peak_row[-1]
+        self.index = self.index.append(pd.DatetimeIndex(prices.index))
+        return self
+
+    # ---------- results ----------
+
+    def _frame(self, values):
+        return pd.DataFrame(values, index=self.index, columns=self.columns)
+
+    @property
+    def peak(self):
+        return self._frame(self._peak)
+
+    @property
+    def drawdown(self):
+        return self._frame(self._drawdown)
+
+    @property
+    def max_drawdown(self):
+        return self._frame(self._max_drawdown)
+
+    @property
+    def duration(self):
+        return self._frame(self._duration)
+
+    def summary(self):
+        # deepest drawdown of every ticker with its peak, trough and recovery dates,
+        # duration is peak -> recovery (or the last bar), recovery time is trough -> recovery
+        n = len(self.index)
+        columns = np.arange(len(self.columns))
+        rows = np.arange(n)[:, None]
+        drawdown = self._drawdown
+
+        trough = np.argmin(np.where(np.isnan(drawdown), np.inf, drawdown), axis=0)
+        peak = (trough - self._duration[trough, columns]).astype(int)
+
+        # first bar back at the peak after every row
+        at_peak = ~(drawdown < 0)
+        next_peak = np.minimum.accumulate(np.where(at_peak, rows, n)[::-1], axis=0)[::-1]
+        recovery = next_peak[trough, columns]
+        recovered = recovery < n
+
+        dates = self.index
+        return pd.DataFrame({'max drawdown': drawdown[trough, columns],
+                             'peak': dates[peak],
+                             'trough': dates[trough],
+                             'recovery': dates[np.minimum(recovery, n - 1)].where(recovered),
+                             'duration, bars': np.where(recovered, recovery, n - 1) - peak,
+                             'recovery, bars': np.where(recovered, recovery - trough, np.nan)},
+                            index=self.columns)
+
+
+def compute_drawdowns(prices, window=None):
+    return DrawdownTracker(window).update(prices)
@@ -0,0 +1,299 @@
+#######################
+# Imports
+#######################
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import cvxpy as cp
+
+from pypfopt.exceptions import OptimizationError
+
+import covariance
+
+#######################
+# Configs
+#######################
+# points on the solved frontier
+DEFAULT_POINTS = 100
+
+# how many solved frontiers are kept
+CACHE_SIZE = 16
+
+# interior point solvers for the points the default (OSQP) doesn't finish
+FALLBACK_SOLVERS = ['CLARABEL', 'ECOS']
+
+_cache = OrderedDict()
+
+
+# ================================================
+# frontier solved once, objectives answered from it
+# ================================================
+
+class Frontier:
+    # long-only (or weight_bounds) mean-variance frontier of mu/Sigma,
+    # Sigma is a dense matrix or a covariance.FactorCovariance
+    # one parametrized QP (min risk s.t. return >= target) is built once
+    # and re-solved with warm starts for every point, the objectives
+    # of the optimization page are lookups or short warm-started refinements on it
+
+    def __init__(self, mu, Sigma, weight_bounds=(0, 1), points=DEFAULT_POINTS):
+        self.tickers = list(mu.index)
+        self.weight_bounds = weight_bounds
+        self.points = points
+
+        # mu, a square root of Sigma (n x n, or n x factors plus specific risk)
+        # are parameters, so update() with new estimates for the same tickers
+        # reuses the compiled problems
+        n = len(self.tickers)
+        n_columns = Sigma.loadings.shape[1] if isinstance(Sigma, covariance.FactorCovariance) else n
+        lower, upper = weight_bounds
+        self._w = cp.Variable(n)
+        self._target = cp.Parameter()
+        self._mu = cp.Parameter(n)
+        self._root = cp.Parameter((n, n_columns))
+        self._specific_root = cp.Parameter(n, nonneg=True)
+        constraints = [cp.sum(self._w) == 1, self._w >= lower, self._w <= upper]
+        risk = self._risk(self._w)
+
+        self._min_vol_problem = cp.Problem(cp.Minimize(risk), constraints)
+        self._max_return_problem = cp.Problem(cp.Maximize(self._mu @ self._w), constraints)
+        self._problem = cp.Problem(cp.Minimize(risk), constraints + [self._mu @ self._w >= self._target])
+
+        # max sharpe in the homogenized form (w = y / k) is a single QP on the same parameters
+        self._y = cp.Variable(n)
+        self._k = cp.Variable()
+        self._risk_free_rate = cp.Parameter()
+        self._sharpe_problem = cp.Problem(
+            cp.Minimize(self._risk(self._y)),
+            [(self._mu - self._risk_free_rate) @ self._y == 1,
+             cp.sum(self._y) == self._k,
+             self._k >= 0,
+             self._y >= lower * self._k,
+             self._y <= upper * self._k])
+
+        self.update(mu, Sigma)
+
+    def _risk(self, w):
+        return cp.sum_squares(self._root.T @ w) + cp.sum_squares(cp.multiply(self._specific_root, w))
+
+    def update(self, mu, Sigma):
+        # new estimates for the same tickers (e.g. the next backtest window)
+        self.mu = np.asarray(mu, dtype=float)
+
+        root, specific = covariance.risk_root(Sigma)
+        self._root_value = root
+        self._specific = specific
+        self._root.value = root
+        self._specific_root.value = np.sqrt(specific)
+        self._mu.value = self.mu
+
+        # solved points outside the grid, keyed by objective and its argument
+        self._refined = {}
+
+        self._solve_grid(self.points)
+        return self
+
+    # ---------- solving ----------
+
+    @staticmethod
+    def _solve_problem(problem, warm_start=False):
+        # default solver (OSQP) first, an interior point solver if it fails or raises:
+        # close to the max-return end OSQP can run out of iterations, ill-conditioned
+        # windows can make it raise; OptimizationError if nothing solves the problem
+        try:
+            problem.solve(warm_start=warm_start)
+            solved = problem.status in ('optimal', 'optimal_inaccurate')
+        except cp.SolverError:
+            solved = False
+        if solved:
+            return
+        solver = next((s for s in FALLBACK_SOLVERS if s in cp.installed_solvers()), None)
+        if solver is None:
+            raise OptimizationError('Frontier point could not be solved: ' + str(problem.status))
+        try:
+            problem.solve(solver=solver)
+        except cp.SolverError as e:
+            raise OptimizationError(f'Frontier point could not be solved: {e}')
+
+    def _check(self, problem):
+        if problem.status not in ('optimal', 'optimal_inaccurate'):
+            raise OptimizationError('Frontier point could not be solved: ' + str(problem.status))
+        # solver noise like -1e-10 would otherwise look like a short position downstream
+        return np.clip(np.array(self._w.value, dtype=float), *self.weight_bounds)
+
+    def _solve(self, target, start=None):
+        # min risk for a target return, warm-started from start (a neighbouring point)
+        if start is not None:
+            self._w.value = start
+        self._target.value = float(target)
+        self._solve_problem(self._problem, warm_start=True)
+        return self._check(self._problem)
+
+    def _solve_grid(self, points):
+        self._solve_problem(self._min_vol_problem)
+        min_vol_weights = self._check(self._min_vol_problem)
+        self._solve_problem(self._max_return_problem)
+        max_return_weights = self._check(self._max_return_problem)
+
+        self.min_return = float(self.mu @ min_vol_weights)
+        self.max_return = float(self.mu @ max_return_weights)
+
+        # every point starts from the solution of its left neighbour,
+        # both ends are already known and the right one is degenerate for the QP
+        targets = np.linspace(self.min_return, self.max_return, max(points, 2))
+        weights = [min_vol_weights]
+        for target in targets[1:-1]:
+            weights.append(self._solve(target, start=weights[-1]))
+        weights.append(max_return_weights)
+
+        self.weights = np.vstack(weights)
+        self.returns = self.weights @ self.mu
+        self.volatilities = np.sqrt(self._variances(self.weights))
+
+    def _variances(self, weights):
+        # w' Sigma w for every row of weights
+        weights = np.atleast_2d(weights)
+        return np.sum((weights @ self._root_value) ** 2, axis=1) + (weights ** 2) @ self._specific
+
+    def _volatility(self, w):
+        return float(np.sqrt(self._variances(w)[0]))
+
+    def asset_volatilities(self):
+        return np.sqrt(np.sum(self._root_value ** 2, axis=1) + self._specific)
+
+    def _nearest(self, target):
+        i = int(np.clip(np.searchsorted(self.returns, target), 0, len(self.returns) - 1))
+        return self.weights[i]
+
+    def _to_dict(self, w):
+        return OrderedDict(zip(self.tickers, w))
+
+    # ---------- objectives ----------
+
+    def min_volatility(self):
+        return self._to_dict(self.weights[0])
+
+    def efficient_return(self, target_return):
+        if target_return > self.max_return + 1e-9:
+            raise ValueError('target_return must be lower than the maximum possible return')
+        if target_return <= self.min_return:
+            return self.min_volatility()
+        if target_return >= self.max_return:
+            return self._to_dict(self.weights[-1])
+
+        key = ('return', float(target_return))
+        if key not in self._refined:
+            self._refined[key] = self._solve(target_return, start=self._nearest(target_return))
+        return self._to_dict(self._refined[key])
+
+    def efficient_risk(self, target_volatility, tol=1e-7, max_iter=60):
+        if target_volatility < self.volatilities[0] - 1e-9:
+            raise ValueError('The minimum volatility is {:.3f}. Please use a higher target_volatility'
+                             .format(self.volatilities[0]))
+        if target_volatility >= self.volatilities[-1]:
+            return self._to_dict(self.weights[-1])
+
+        key = ('risk', float(target_volatility))
+        if key not in self._refined:
+            # volatility grows along the frontier, bisect the return inside the bracketing grid points
+            i = int(np.searchsorted(self.volatilities, target_volatility))
+            if i == 0:
+                self._refined[key] = self.weights[0]
+                return self._to_dict(self.weights[0])
+            low, high = self.returns[i - 1], self.returns[i]
+            w = self.weights[i]
+            for _ in range(max_iter):
+                middle = (low + high) / 2
+                w = self._solve(middle, start=w)
+                volatility = self._volatility(w)
+                if abs(volatility - target_volatility) < tol:
+                    break
+                if volatility > target_volatility:
+                    high = middle
+                else:
+                    low = middle
+            self._refined[key] = w
+        return self._to_dict(self._refined[key])
+
+    def max_sharpe(self, risk_free_rate=0.02):
+        if not np.any(self.mu > risk_free_rate):
+            raise ValueError('at least one of the assets must have an expected return exceeding the risk-free rate')
+
+        key = ('sharpe', float(risk_free_rate))
+        if key not in self._refined:
+            # tangency portfolio, warm-started from the best grid point
+            sharpe = (self.returns - risk_free_rate) / self.volatilities
+            start = self.weights[int(np.nanargmax(sharpe))]
+            excess = float((self.mu - risk_free_rate) @ start)
+            if excess > 0:
+                self._y.value = start / excess
+                self._k.value = 1 / excess
+            self._risk_free_rate.value = float(risk_free_rate)
+            self._solve_problem(self._sharpe_problem, warm_start=True)
+            if self._sharpe_problem.status not in ('optimal', 'optimal_inaccurate'):
+                raise OptimizationError('Max sharpe could not be solved: ' + str(self._sharpe_problem.status))
+            w = np.array(self._y.value, dtype=float) / float(self._k.value)
+            self._refined[key] = np.clip(w, *self.weight_bounds)
+        return self._to_dict(self._refined[key])
+
+    # ---------- results ----------
+
+    def portfolio_performance(self, weights, risk_free_rate=0.02):
+        # same numbers as pypfopt's portfolio_performance, without a dense Sigma
+        w = np.array([weights[t] for t in self.tickers], dtype=float)
+        expected_return = float(self.mu @ w)
+        volatility = self._volatility(w)
+        return expected_return, volatility, (expected_return - risk_free_rate) / volatility
+
+    @staticmethod
+    def clean_weights(weights, cutoff=1e-4, rounding=5):
+        # same as pypfopt's clean_weights
+        clean = OrderedDict()
+        for ticker, w in weights.items():
+            w = 0.0 if abs(w) < cutoff else w
+            clean[ticker] = float(np.round(w, rounding)) if rounding is not None else float(w)
+        return clean
+
+    # ---------- plotting ----------
+
+    def plot(self, ax, show_assets=True):
+        # same look as pypfopt.plotting.plot_efficient_frontier, without re-solving
+        ax.plot(self.volatilities, self.returns, label='Efficient frontier')
+        if show_assets:
+            ax.scatter(self.asset_volatilities(), self.mu, s=30, color='k', label='assets')
+            for ticker, x, y in zip(self.tickers, self.asset_volatilities(), self.mu):
+                ax.annotate(ticker, (x, y))
+        ax.legend()
+        ax.set_xlabel('Volatility')
+        ax.set_ylabel('Return')
+        return ax
+
+
+# ================================================
+# cache of solved frontiers
+# ================================================
+
+def fingerprint(mu, Sigma, weight_bounds=(0, 1), points=DEFAULT_POINTS):
+    digest = hashlib.sha1()
+    digest.update(repr((list(mu.index), weight_bounds, points)).encode())
+    digest.update(np.ascontiguousarray(mu, dtype=float).tobytes())
+    if isinstance(Sigma, covariance.FactorCovariance):
+        digest.update(np.ascontiguousarray(Sigma.loadings, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(Sigma.specific, dtype=float).tobytes())
+    else:
+        digest.update(np.ascontiguousarray(Sigma, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def get_frontier(mu, Sigma, weight_bounds=(0, 1), points=DEFAULT_POINTS):
+    key = fingerprint(mu, Sigma, weight_bounds, points)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    frontier = Frontier(mu, Sigma, weight_bounds=weight_bounds, points=points)
+    _cache[key] = frontier
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return frontier
@@ -0,0 +1,213 @@
+#######################
+# Imports
+#######################
+import os
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+#######################
+# Configs
+#######################
+# jobs running at the same time, the rest wait in the queue
+WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# finished jobs kept with their results (failed and cancelled ones included)
+CACHE_SIZE = 32
+
+STATES = ['queued', 'running', 'done', 'failed', 'cancelled']
+
+
+# ================================================
+# one job
+# ================================================
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # state, progress and result of one function call on the worker pool,
+    # read by the page on every rerun while a worker thread updates it
+
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+        self.state = 'queued'
+        self.progress = 0.0
+        self.message = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def finished_state(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def cancel(self):
+        # a queued job never starts, a running one stops at its next checkpoint()
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self.state = 'cancelled'
+            self.message = 'cancelled'
+            self.finished = time.time()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+
+# the job of the running worker thread, None outside of jobs
+_current = contextvars.ContextVar('job', default=None)
+
+
+def current_job():
+    return _current.get()
+
+
+def checkpoint(progress=None, message=None):
+    # called by the code a job runs between its stages (pipeline.optimize does),
+    # reports progress (None keeps the last one) and stops a cancelled job;
+    # does nothing outside of jobs
+    job = _current.get()
+    if job is None:
+        return
+    if job.cancel_requested:
+        raise JobCancelled(job.key)
+    if progress is not None:
+        job.progress = float(progress)
+    if message is not None:
+        job.message = message
+
+
+# ================================================
+# queue of jobs keyed by their inputs
+# ================================================
+
+def job_key(name, *args, **kwargs):
+    # same function and inputs -> same key; inputs must have a stable repr
+    # (pass a fingerprint instead of a big frame)
+    digest = hashlib.sha1()
+    digest.update(repr((name, args, sorted(kwargs.items()))).encode())
+    return digest.hexdigest()
+
+
+class JobQueue:
+
+    def __init__(self, workers=WORKERS, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        # running and queued jobs, then finished ones in LRU order
+        self._active = {}
+        self._finished = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, func, *args, key=None, name=None, **kwargs):
+        # func(*args, **kwargs) on the pool, unless the same inputs already ran
+        # or are running: then that job is returned; a failed or cancelled job is run again
+        name = name or getattr(func, '__name__', 'job')
+        key = key or job_key(name, *args, **kwargs)
+        with self._lock:
+            job = self._active.get(key) or self._finished.get(key)
+            if job is not None and job.state not in ('failed', 'cancelled'):
+                self.hits += 1
+                if key in self._finished:
+                    self._finished.move_to_end(key)
+                return job
+
+            self.misses += 1
+            self._finished.pop(key, None)
+            job = Job(key, name)
+            self._active[key] = job
+            job._future = self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        token = _current.set(job)
+        try:
+            if job.cancel_requested:
+                raise JobCancelled(job.key)
+            job.state = 'running'
+            job.message = 'running'
+            job.started = time.time()
+            job.result = func(*args, **kwargs)
+            job.progress = 1.0
+            job.message = 'done'
+            job.state = 'done'
+        except JobCancelled:
+            job.message = 'cancelled'
+            job.state = 'cancelled'
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            job.message = 'failed'
+            job.state = 'failed'
+        finally:
+            job.finished = time.time()
+            _current.reset(token)
+            self._done(job)
+
+    def _done(self, job):
+        with self._lock:
+            self._active.pop(job.key, None)
+            self._finished[job.key] = job
+            if len(self._finished) > self.maxsize:
+                self._finished.popitem(last=False)
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            return self._active.get(key) or self._finished.get(key)
+
+    def cancel(self, key):
+        job = self.get(key)
+        if job is not None:
+            job.cancel()
+            if job.state == 'cancelled':
+                # never started, _run won't report it
+                self._done(job)
+        return job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._active.values()) + list(self._finished.values())
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            active = len(self._active)
+            finished = len(self._finished)
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else float('nan'),
+                'active': active,
+                'finished': finished,
+                'maxsize': self.maxsize}
+
+
+# one queue per process: jobs outlive the script run (and the session) that submitted them
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,135 @@
+#######################
+# Imports
+#######################
+import os
+import sys
+import time
+import types
+import argparse
+import builtins
+import importlib
+import importlib.util
+
+import pandas as pd
+
+#######################
+# Configs
+#######################
+# STARTUP_PROFILE=1 records how long every import of the app takes
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', '0') == '1'
+
+
+# ================================================
+# modules imported at first attribute access
+# ================================================
+
+class LazyModule(types.ModuleType):
+    # stands in for a module until one of its attributes is used,
+    # unlike importlib.util.LazyLoader the parent package isn't imported either
+    # (pypfopt.plotting would pull in pypfopt and cvxpy right away)
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_name'] = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__dict__['_lazy_name'])
+        # later lookups hit the instance dict directly
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    # `plt = lazy_import('matplotlib.pyplot')` instead of `import matplotlib.pyplot as plt`
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+# ================================================
+# import-time profiler
+# ================================================
+# like python -X importtime, but usable inside the streamlit server process
+
+_original_import = builtins.__import__
+_records = []
+_stack = []
+
+
+def _resolve(name, globals, level):
+    if level == 0:
+        return name
+    try:
+        return importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__'))
+    except (ImportError, ValueError):
+        return name
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # modules that are already loaded cost nothing worth recording
+    if level == 0 and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        seconds = time.perf_counter() - started
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += seconds
+        _records.append({'module': _resolve(name, globals, level),
+                         'depth': len(_stack),
+                         'cumulative_seconds': seconds,
+                         'self_seconds': seconds - children})
+
+
+def install():
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    builtins.__import__ = _original_import
+
+
+def installed():
+    return builtins.__import__ is _timed_import
+
+
+def report(top=None, depth=None):
+    # one row per import statement that loaded something, slowest first,
+    # depth 0 are the imports of the app itself
+    df = pd.DataFrame(_records, columns=['module', 'depth', 'cumulative_seconds', 'self_seconds'])
+    if depth is not None:
+        df = df[df['depth'] <= depth]
+    df = df.sort_values('cumulative_seconds', ascending=False).reset_index(drop=True)
+    return df if top is None else df.head(top)
+
+
+if STARTUP_PROFILE:
+    install()
+
+
+# ================================================
+# command line
+# ================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import times of modules of the app (run in a fresh process)')
+    parser.add_argument('modules', nargs='+', help='e.g. analytics optimization')
+    parser.add_argument('--top', type=int, default=30)
+    parser.add_argument('--depth', type=int, default=None, help='only imports nested at most this deep')
+    args = parser.parse_args(argv)
+
+    install()
+    for name in args.modules:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        print(f'{name}: {time.perf_counter() - started:.3f}s')
+    uninstall()
+    print(report(args.top, args.depth).to_string())
+
+
+if __name__ == '__main__':
+    main()
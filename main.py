@@ -6,7 +6,7 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 
-import pandas_datareader as pdr
+import symbols
 import yfinance as yf
 
 from pypfopt.efficient_frontier import EfficientFrontier
@@ -72,18 +72,10 @@ def change_target_return():
 # Cols description
 # http://www.nasdaqtrader.com/trader.aspx?id=symboldirdefs
 
-df_tickers = pdr.nasdaq_trader.get_nasdaq_symbols(retry_count=3, timeout=30, pause=None)
+directory = symbols.get_directory()
+df_tickers = directory.tickers
 
-mask = ((df_tickers['Financial Status'] == 'N')&
-        (df_tickers['ETF'] == False)&
-        (df_tickers['Market Category'] == 'Q')&
-        (df_tickers['Test Issue'] == False)&
-        (df_tickers['NextShares'] == False)&
-        (df_tickers['Nasdaq Traded'] == True))
-
-df_tickers = df_tickers.loc[mask]
-
-tickers = df_tickers.index
+tickers = directory.symbols
     
 # ================================================    
 # Дисклеймер: кнопка, текст и таймер
@@ -182,7 +174,7 @@ with tickers_container:
     st.checkbox('Show more securities info',key='show_more',value=False)
     
     if st.session_state['show_more'] == True:
-        st.table(df_tickers.loc[tickers_selection,'Security Name'])
+        st.table(directory.security_names(tickers_selection))
 
 # ================================================
 # Загрузка ценовой истории выбранных тикеров
@@ -0,0 +1,163 @@
+#######################
+# Imports
+#######################
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import covariance
+import jobs
+
+#######################
+# Configs
+#######################
+# random portfolios drawn for the frontier chart
+DEFAULT_PORTFOLIOS = 1_000_000
+
+# working memory of a chunk of weights and its products, bytes
+MEMORY_BUDGET = int(os.environ.get('MONTE_CARLO_MEMORY_BUDGET', 64 * 2**20))
+
+# processes of the simulation, 1 runs it in the calling thread
+WORKERS = int(os.environ.get('MONTE_CARLO_WORKERS', 1))
+
+# Dirichlet concentrations used in turn by the chunks: 1 is uniform on the simplex,
+# which for many assets stays close to equal weights, smaller values reach the
+# concentrated portfolios near the frontier and the single assets
+ALPHAS = (1.0, 0.3, 0.1)
+
+# (volatility x return) density grid
+BINS = (200, 200)
+
+
+# ================================================
+# one chunk of random long-only portfolios
+# ================================================
+
+def chunk_rows(n_assets, memory_budget=MEMORY_BUDGET):
+    # weights, their square and the (rows x factors) product in float64
+    return max(int(memory_budget // (8 * (3 * n_assets + 8))), 1)
+
+
+def _grid(mu, root, specific, bins):
+    # a long-only portfolio's return lies between the lowest and highest mu
+    # and its volatility below the highest asset volatility (the norm is convex)
+    low, high = float(np.min(mu)), float(np.max(mu))
+    if high <= low:
+        low, high = low - 1e-3, high + 1e-3
+    max_volatility = float(np.sqrt(np.max(np.sum(root ** 2, axis=1) + specific)))
+    return (np.linspace(0, max_volatility * (1 + 1e-9) or 1e-3, bins[0] + 1),
+            np.linspace(low, high + (high - low) * 1e-9, bins[1] + 1))
+
+
+def _simulate(mu, root, specific, rows, alpha, seed, edges, risk_free_rate):
+    # counts of one chunk on the grid and its best Sharpe portfolio
+    rng = np.random.default_rng(seed)
+    weights = rng.standard_gamma(alpha, size=(rows, len(mu)))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    returns = weights @ mu
+    volatilities = np.sqrt(np.sum((weights @ root) ** 2, axis=1) + (weights ** 2) @ specific)
+
+    volatility_edges, return_edges = edges
+    x = np.clip(np.searchsorted(volatility_edges, volatilities, 'right') - 1, 0, len(volatility_edges) - 2)
+    y = np.clip(np.searchsorted(return_edges, returns, 'right') - 1, 0, len(return_edges) - 2)
+    n_y = len(return_edges) - 1
+    counts = np.bincount(x * n_y + y, minlength=(len(volatility_edges) - 1) * n_y)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = (returns - risk_free_rate) / volatilities
+    best = int(np.nanargmax(sharpe)) if np.isfinite(sharpe).any() else 0
+    return counts, {'sharpe': float(sharpe[best]),
+                    'return': float(returns[best]),
+                    'volatility': float(volatilities[best]),
+                    'weights': weights[best].copy()}
+
+
+# ================================================
+# many chunks, optionally over a process pool
+# ================================================
+
+# mu, root and specific, set once per worker process
+_shared_model = None
+
+
+def _init_worker(mu, root, specific):
+    global _shared_model
+    _shared_model = (mu, root, specific)
+
+
+def _simulate_task(task):
+    rows, alpha, seed, edges, risk_free_rate = task
+    return _simulate(*_shared_model, rows, alpha, seed, edges, risk_free_rate)
+
+
+def random_portfolios(mu, Sigma, n_portfolios=DEFAULT_PORTFOLIOS, risk_free_rate=0.02,
+                      bins=BINS, alphas=ALPHAS, seed=0, workers=WORKERS, memory_budget=MEMORY_BUDGET):
+    # return / volatility density of n_portfolios Dirichlet long-only portfolios,
+    # mu: Series, Sigma: dense or covariance.FactorCovariance, both annualized
+    # nothing per portfolio is kept: chunks of weights are reduced to counts on a fixed grid,
+    # the result doesn't depend on workers (every chunk has its own seed)
+    # returns {'counts' (volatility bins x return bins), 'volatility_edges', 'return_edges',
+    #          'portfolios', 'best' (highest sampled Sharpe: sharpe, return, volatility, weights)}
+    tickers = list(mu.index)
+    mu_values = np.asarray(mu, dtype=float)
+    root, specific = covariance.risk_root(Sigma, tickers)
+    edges = _grid(mu_values, root, specific, bins)
+
+    rows = chunk_rows(len(tickers), memory_budget)
+    sizes = [min(rows, n_portfolios - start) for start in range(0, n_portfolios, rows)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(size, alphas[i % len(alphas)], seeds[i], edges, risk_free_rate) for i, size in enumerate(sizes)]
+
+    counts = np.zeros(bins[0] * bins[1], dtype=np.int64)
+    best = None
+
+    def add(result):
+        nonlocal counts, best
+        chunk_counts, chunk_best = result
+        counts += chunk_counts
+        if best is None or chunk_best['sharpe'] > best['sharpe']:
+            best = chunk_best
+
+    if workers == 1:
+        for i, task in enumerate(tasks):
+            jobs.checkpoint(message=f'random portfolios, chunk {i + 1} of {len(tasks)}')
+            add(_simulate(mu_values, root, specific, *task))
+    else:
+        # the model goes to every worker once, not with every chunk;
+        # spawned workers, as the caller may be a thread of the streamlit server
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(mu_values, root, specific))
+        try:
+            for i, result in enumerate(executor.map(_simulate_task, tasks)):
+                jobs.checkpoint(message=f'random portfolios, chunk {i + 1} of {len(tasks)}')
+                add(result)
+        finally:
+            # a cancelled job doesn't wait for the chunks not started yet
+            executor.shutdown(cancel_futures=True)
+
+    if best is not None:
+        best['weights'] = dict(zip(tickers, best['weights']))
+    return {'counts': counts.reshape(bins),
+            'volatility_edges': edges[0],
+            'return_edges': edges[1],
+            'portfolios': n_portfolios,
+            'best': best}
+
+
+# ================================================
+# plotting
+# ================================================
+
+def plot_cloud(ax, cloud, cmap='Blues'):
+    # log density of the random portfolios under the frontier line (draw this first)
+    counts = cloud['counts'].T.astype(float)
+    counts[counts == 0] = np.nan
+    mesh = ax.pcolormesh(cloud['volatility_edges'], cloud['return_edges'], np.log10(counts),
+                         cmap=cmap, shading='flat', zorder=0)
+    ax.figure.colorbar(mesh, ax=ax, label=f'log10 portfolios ({cloud["portfolios"]:,} drawn)')
+    return ax
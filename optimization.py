@@ -6,7 +6,6 @@ from io import BytesIO # to overcome streamlit problem
 # # efficient frontier plotting but converting
 # # matplotlib fig to plotly
 
-import copy
 import time
 import datetime as dt
 
@@ -15,19 +14,127 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
+import price_store
+import covariance
+import tracing
+import debug_panel
+import lazy_imports
+import jobs
+import shared_prices
+# widget choices, without the optimizer stack
+import options
 
-import pandas_datareader as pdr
-import yfinance as yf
+# the optimizer stack (pypfopt, cvxpy, matplotlib) is imported on the first 'Optimize'
+plotting = lazy_imports.lazy_import('pypfopt.plotting')
+risk_cache = lazy_imports.lazy_import('risk_cache')
+pipeline = lazy_imports.lazy_import('pipeline')
+backtest = lazy_imports.lazy_import('backtest')
+figure = lazy_imports.lazy_import('matplotlib.figure')
+monte_carlo = lazy_imports.lazy_import('monte_carlo')
+resampled = lazy_imports.lazy_import('resampled')
 
-from pypfopt.efficient_frontier import EfficientFrontier
-from pypfopt import risk_models
-from pypfopt import expected_returns
-from pypfopt import plotting
-from pypfopt.discrete_allocation import DiscreteAllocation, get_latest_prices
+# seconds between reruns while the optimization job is running
+POLL_SECONDS = 0.5
 
 
 
+# ================================================
+# the optimization job, on a worker thread
+# ================================================
+# no streamlit calls in here: the result is everything the page shows,
+# charts included (as PNG, drawn without pyplot which isn't thread-safe)
+
+def _png(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def run_optimization(tickers, params, backtest_params=None, random_portfolios=0, resample_params=None):
+    trace = tracing.start_trace('optimization job')
+    try:
+        # Загрузка ценовой истории выбранных тикеров
+        jobs.checkpoint(0.0, 'download')
+        with tracing.span('download') as download:
+            prices = price_store.load_prices(list(tickers))
+            download.rows = prices.size
+        result = {'failures': prices.attrs['failures'], 'prices': None, 'trace': trace}
+        if prices.empty:
+            return result
+        df = prices['Adj Close']
+        result['prices'] = df
+
+        # mu/Sigma are memoized by price block and the frontier by mu/Sigma,
+        # changing only the target or the rates skips estimation
+        result.update(pipeline.optimize(df, **params))
+
+        # feasible region of long-only portfolios under the frontier line
+        result['cloud'] = None
+        if random_portfolios:
+            jobs.checkpoint(0.82, 'random portfolios')
+            with tracing.span('random portfolios', rows=random_portfolios):
+                result['cloud'] = monte_carlo.random_portfolios(result['mu'], result['Sigma'], random_portfolios,
+                                                                risk_free_rate=params['risk_free_rate'])
+
+        jobs.checkpoint(0.85, 'charts')
+        with tracing.span('plot frontier', rows=len(result['weights'])):
+            fig = figure.Figure(figsize=(5, 4) if result['cloud'] else (4, 4))
+            ax = fig.subplots()
+            if result['cloud']:
+                monte_carlo.plot_cloud(ax, result['cloud'])
+            result['frontier'].plot(ax=ax, show_assets=True)
+            result['frontier_png'] = _png(fig)
+        with tracing.span('plot weights', rows=len(result['weights'])):
+            fig = figure.Figure()
+            plotting.plot_weights(result['weights'], ax=fig.subplots())
+            result['weights_png'] = _png(fig)
+
+        # mean weights of the target over bootstraps of the return history, with their band
+        result['resampled'] = None
+        if resample_params is not None:
+            jobs.checkpoint(0.87, 'resampled frontier')
+            with tracing.span('resampled frontier', rows=df.size):
+                # a copy: the cached result is shared with jobs of other risk models
+                resample = dict(resampled.cached_resample(df, **resample_params))
+                # the averaged portfolio on the full-history mu/Sigma
+                root, specific = covariance.risk_root(result['Sigma'], list(resample['weights'].index))
+                w = resample['weights'].to_numpy()
+                annual_return = float(w @ result['mu'][resample['weights'].index].to_numpy())
+                annual_volatility = float(np.sqrt(np.sum((w @ root) ** 2) + (w ** 2) @ specific))
+                resample['performance'] = (annual_return, annual_volatility,
+                                           (annual_return - params['risk_free_rate']) / annual_volatility)
+                fig = figure.Figure()
+                ax = fig.subplots()
+                order = resample['weights'].sort_values().index
+                ax.barh(range(len(order)), resample['weights'][order],
+                        xerr=[resample['weights'][order] - resample['low'][order],
+                              resample['high'][order] - resample['weights'][order]],
+                        capsize=2)
+                ax.set_yticks(range(len(order)))
+                ax.set_yticklabels(order)
+                ax.set_xlabel('Weight')
+                resample['weights_png'] = _png(fig)
+                result['resampled'] = resample
+
+        # walk-forward backtest of the same target
+        result['backtest'] = None
+        if backtest_params is not None:
+            jobs.checkpoint(0.9, 'backtest')
+            with tracing.span('backtest', rows=df.size):
+                result['backtest'] = backtest.walk_forward(df, **backtest_params)
+        return result
+    finally:
+        tracing.finish_trace(trace)
+
+
+def _account_sizes(text):
+    # 'Account sizes' text -> list of floats, None if empty
+    try:
+        return [float(v) for v in text.replace(';', ',').split(',') if v.strip()] or None
+    except ValueError:
+        raise ValueError(f'Account sizes must be numbers separated by commas, got "{text}"')
+
+
 # ================================================
 # main function
 # ================================================    
@@ -43,7 +150,7 @@ def app(tickers):
         st.checkbox('Show debug info',key='debug_info')
 
         # поле ввода цели оптимизации и доп аргументов
-        col3,col4,_,_ = st.columns(4)
+        col3,col4,col_risk,col_cloud = st.columns(4)
 
         col3.selectbox('Optimization target',
                        ['Max Sharpe',
@@ -57,11 +164,24 @@ def app(tickers):
                                        key='risk_free_rate',
                                         step=0.001)
 
+        # chunked / factor models keep memory bounded for big baskets
+        col_risk.selectbox('Risk model',
+                           covariance.RISK_MODELS,
+                           key='risk_model_select_box')
+
+        # Monte Carlo cloud of long-only portfolios under the frontier chart
+        col_cloud.number_input('Random portfolios (0 = none)',
+                               min_value=0,
+                               max_value=10_000_000,
+                               value=0,
+                               step=100_000,
+                               key='random_portfolios')
+
 
         additional_parameters = st.container()
 
         with additional_parameters:
-            col5,col6,_,_ = st.columns(4)
+            col5,col6,col_allocation,col_accounts = st.columns(4)
             
             amount_to_invest = col5.number_input('Amount to invest',
                                                  min_value=0,
@@ -69,6 +189,15 @@ def app(tickers):
                                                  value=20000,
                                                  key='amount_to_invest')
 
+            # largest remainder is instant, lp runs an integer program
+            col_allocation.selectbox('Allocation method',
+                                     ['lp', 'largest_remainder'],
+                                     key='allocation_method_select_box')
+
+            # allocation table of many account sizes from the same weights
+            col_accounts.text_input('Account sizes (comma separated)',
+                                    key='account_sizes')
+
             if st.session_state['optimization_target_select_box'] == 'Efficient risk':
                 target_volatility = col6.number_input('Target volatility',
                                                       value=st.session_state['target_volatility'],
@@ -86,139 +215,250 @@ def app(tickers):
             elif st.session_state['optimization_target_select_box'] == 'Minimum volatility':
                 pass
 
+        # walk-forward backtest of the same target
+        backtest_parameters = st.container()
+
+        with backtest_parameters:
+            st.checkbox('Walk-forward backtest', key='backtest')
+
+            if st.session_state['backtest'] == True:
+                col7,col8,col9,_ = st.columns(4)
+                col7.number_input('Estimation window, days',
+                                  min_value=20,
+                                  value=252,
+                                  step=21,
+                                  key='backtest_window')
+                col8.selectbox('Rebalance every',
+                               list(options.REBALANCE_FREQUENCIES.keys()),
+                               index=1,
+                               key='backtest_rebalance')
+                col9.checkbox('Expanding window', key='backtest_expanding')
+
+        # the target re-solved on bootstraps of the return history, averaged
+        resample_parameters = st.container()
+
+        with resample_parameters:
+            st.checkbox('Resampled frontier', key='resampled')
+
+            if st.session_state['resampled'] == True:
+                col10,col11,_,_ = st.columns(4)
+                col10.number_input('Bootstrap samples',
+                                   min_value=10,
+                                   max_value=5000,
+                                   value=options.RESAMPLE_SAMPLES,
+                                   step=50,
+                                   key='resample_samples')
+                # longer blocks keep volatility clustering of the returns
+                col11.number_input('Block length, days',
+                                   min_value=1,
+                                   max_value=252,
+                                   value=1,
+                                   step=5,
+                                   key='resample_block')
+
 
 
     # ================================================
     # Запуск оптимизатора
     # ================================================
-    
+    # the job runs on the process-wide queue: the script only submits it and polls,
+    # a widget touch doesn't restart it and the same inputs are never computed twice
+
+    queue = jobs.get_queue()
+
     if st.button('Optimize'):
-        
-        # Загрузка ценовой истории выбранных тикеров
-            try:
-                df = yf.download(st.session_state['tickers_in_portfolio'])['Adj Close']
-                
-                if st.session_state['debug_info'] == True:
-                    st.write(df.head())
-            except:
-                pass
+        try:
+            portfolio_values = _account_sizes(st.session_state['account_sizes'])
+        except ValueError as e:
+            # a bad input doesn't submit the job
+            st.error(str(e))
+        else:
+            params = {'target': st.session_state['optimization_target_select_box'],
+                      'risk_free_rate': risk_free_rate,
+                      'target_volatility': st.session_state['target_volatility'],
+                      'target_return': st.session_state['target_return'],
+                      'amount_to_invest': amount_to_invest,
+                      'risk_model': st.session_state['risk_model_select_box'],
+                      'allocation_method': st.session_state['allocation_method_select_box'],
+                      'portfolio_values': portfolio_values}
+            backtest_params = None
+            if st.session_state['backtest'] == True:
+                backtest_params = {'target': st.session_state['optimization_target_select_box'],
+                                   'window': int(st.session_state['backtest_window']),
+                                   'expanding': st.session_state['backtest_expanding'],
+                                   'rebalance': st.session_state['backtest_rebalance'],
+                                   'risk_free_rate': risk_free_rate,
+                                   'target_volatility': st.session_state['target_volatility'],
+                                   'target_return': st.session_state['target_return']}
+            resample_params = None
+            if st.session_state['resampled'] == True:
+                resample_params = {'target': st.session_state['optimization_target_select_box'],
+                                   'n_samples': int(st.session_state['resample_samples']),
+                                   'block': int(st.session_state['resample_block']),
+                                   'risk_free_rate': risk_free_rate,
+                                   'target_volatility': st.session_state['target_volatility'],
+                                   'target_return': st.session_state['target_return']}
+            tickers_in_portfolio = tuple(st.session_state['tickers_in_portfolio'])
+            # the price store refreshes once a day, so does the key
+            random_portfolios = int(st.session_state['random_portfolios'])
+            key = jobs.job_key('optimization', tickers_in_portfolio, params, backtest_params, random_portfolios,
+                               resample_params, dt.date.today().isoformat())
+            job = queue.submit(run_optimization, tickers_in_portfolio, params, backtest_params, random_portfolios,
+                               resample_params, key=key, name='optimization')
+            st.session_state['optimization_job'] = job.key
+
+    job = queue.get(st.session_state['optimization_job'])
+    if job is None:
+        return
+
+    if st.session_state['debug_info'] == True:
+        st.write(queue.stats())
+
+    if not job.finished_state:
+        st.progress(job.progress)
+        st.caption(f'{job.message} ({job.seconds:.1f}s)')
+        if st.button('Cancel'):
+            queue.cancel(job.key)
+        time.sleep(POLL_SECONDS)
+        st.experimental_rerun()
+    elif job.state == 'failed':
+        st.write(job.error)
+    elif job.state == 'cancelled':
+        st.info('Optimization cancelled')
+    else:
+        # rendering the finished result is a trace of its own
+        trace = tracing.start_trace('optimization')
+        show_result(job.result)
+        tracing.finish_trace(trace)
+        if st.session_state['debug_info'] == True:
+            debug_panel.show_trace(job.result['trace'])
+            debug_panel.show_trace(trace)
+
+
+def show_result(result):
+    failures = result['failures']
+    if not failures.empty:
+        st.warning(f'Could not download {", ".join(failures.index)}')
+        st.dataframe(failures)
+    if result['prices'] is None:
+        return
+    df = result['prices']
+
+    if st.session_state['debug_info'] == True:
+        st.write(df.head())
+
+    # ================================================
+    # Загрузка цен в оптимизатор ---------------------
+    # ================================================
 
-            # if st.session_state['show_more'] == True:    
-            #     df
-
-        # ================================================
-        # Загрузка цен в оптимизатор ---------------------
-        # ================================================
-
-        # Пояснение
-            '''
-            Mean-variance optimization requires two things: the expected returns of the assets, and the covariance matrix (or more generally, a risk model quantifying asset risk).
-            '''
-
-        # Calculate expected annualized returns and sample covariance
-            with st.spinner('Calculating...'):
-                try:
-                    #########
-                    # calculate expected return and cov matrix
-                    #########                    
-                    mu = expected_returns.mean_historical_return(df)
-                    Sigma = risk_models.sample_cov(df)
-                    
-                    if st.session_state['debug_info'] == True:
-                        mu
-                        Sigma
-                    
-                    #########
-                    # plot Efficient Frontier
-                    #########
-                    st.title('Efficient frontier chart')    
-                    
-                    ef_plotting = EfficientFrontier(mu, Sigma)
-                    
-                    fig, ax = plt.subplots(figsize=(4, 4))
-                    plotting.plot_efficient_frontier(ef_plotting, ax=ax, show_assets=True)
-                    # plt.show()
-                    # st.pyplot(fig)
-                    
-                    # save fig to file
-                    # and load as image
-                    buf = BytesIO()
-                    fig.savefig(buf, format="png")
-                    st.image(buf)
-                    
-                    # plotly_fig = tls.mpl_to_plotly(fig)
-                    # st.plotly_chart(plotly_fig)
-                    
-                    #########
-                    # compute efficient frontier with a target
-                    #########
-                    ef = EfficientFrontier(mu, Sigma)
-                    
-                    # calculate weights
-                    if st.session_state['optimization_target_select_box'] == 'Max Sharpe':
-                        weights = ef.max_sharpe(risk_free_rate)
-
-                    elif st.session_state['optimization_target_select_box'] == 'Efficient risk':
-                        weights = ef.efficient_risk(target_volatility)
-
-                    elif st.session_state['optimization_target_select_box'] == 'Efficient return':
-                        weights = ef.efficient_return(target_return)
-
-                    elif st.session_state['optimization_target_select_box'] == 'Minimum volatility':
-                        weights = ef.min_volatility()
-                        
-                    #########    
-                    # plot weights
-                    #########
-                    st.title('Portfolio weights')    
-                    fig,ax = plt.subplots()
-                    plotting.plot_weights(weights,ax=ax)
-                    buf = BytesIO()
-                    fig.savefig(buf, format="png")
-                    st.image(buf)
-
-                    # get cleaned weights
-                    if st.session_state['debug_info'] == True:
-                        cleaned_weights = ef.clean_weights()                    
-                        st.write(weights)
-                        st.write(cleaned_weights)
-                    
-                    # calculate and display
-                    # porfolio performance
-
-                    expected_annual_return,annual_volatility,sharpe_ratio = ef.portfolio_performance(verbose=True, risk_free_rate = risk_free_rate)
-                    
-                    st.title('Portfolio performace')    
-                    c1, c2, c3 = st.columns(3)
-                    
-                    c1.metric(label="Expected annual return", 
-                              value=str(np.round(expected_annual_return,2)*100)+'%')
-                    
-                    c2.metric(label="Annual volatility", 
-                              value=str(np.round(annual_volatility,2)*100)+'%')
-                    
-                    c3.metric(label="Sharpe ratio", 
-                              value=np.round(sharpe_ratio,2))
-                    
-                    # calculate discrete allocation
-
-                    latest_prices = get_latest_prices(df)
-                    
-                    if st.session_state['debug_info'] == True:
-                        st.write(latest_prices)
-                        
-                    da = DiscreteAllocation(weights, latest_prices, total_portfolio_value=amount_to_invest)
-                    allocation, leftover = da.lp_portfolio()
-                    if st.session_state['debug_info'] == True:
-                        st.write(allocation)
-                        st.write(leftover)
-                    
-                    st.title('Portfolio allocation')   
-                    st.write(pd.DataFrame(allocation,index=['Number of shares']).T)
-                    
-                    
-
-
-                except Exception as e:
-                    st.write(e)
-                    # pass
+    # Пояснение
+    '''
+    Mean-variance optimization requires two things: the expected returns of the assets, and the covariance matrix (or more generally, a risk model quantifying asset risk).
+    '''
+
+    weights = result['weights']
+
+    if st.session_state['debug_info'] == True:
+        result['mu']
+        result['Sigma']
+        st.write(risk_cache.cache.stats())
+        st.write(shared_prices.get_cache().stats())
+
+    #########
+    # plot Efficient Frontier
+    #########
+    st.title('Efficient frontier chart')
+    st.image(result['frontier_png'])
+    if result['cloud'] is not None and result['cloud']['best'] is not None:
+        best = result['cloud']['best']
+        st.caption(f'Best of {result["cloud"]["portfolios"]:,} random portfolios: '
+                   f'return {best["return"]:.2%}, volatility {best["volatility"]:.2%}, Sharpe {best["sharpe"]:.2f}')
+
+    #########
+    # plot weights
+    #########
+    st.title('Portfolio weights')
+    st.image(result['weights_png'])
+
+    # get cleaned weights
+    if st.session_state['debug_info'] == True:
+        st.write(weights)
+        st.write(result['cleaned_weights'])
+
+    # display porfolio performance
+
+    expected_annual_return,annual_volatility,sharpe_ratio = result['performance']
+
+    st.title('Portfolio performace')
+    c1, c2, c3 = st.columns(3)
+
+    c1.metric(label="Expected annual return",
+              value=str(np.round(expected_annual_return,2)*100)+'%')
+
+    c2.metric(label="Annual volatility",
+              value=str(np.round(annual_volatility,2)*100)+'%')
+
+    c3.metric(label="Sharpe ratio",
+              value=np.round(sharpe_ratio,2))
+
+    # display discrete allocation
+
+    if st.session_state['debug_info'] == True:
+        st.write(result['latest_prices'])
+        st.write(result['allocation'])
+        st.write(result['leftover'])
+
+    st.title('Portfolio allocation')
+    st.write(pd.DataFrame(result['allocation'],index=['Number of shares']).T)
+
+    if result['accounts'] is not None:
+        st.title('Account allocations')
+        accounts = result['accounts']
+        st.dataframe(pd.concat([accounts['shares'],
+                                accounts['leftover'],
+                                accounts['weight_rmse'],
+                                accounts['tracking_error']], axis=1))
+
+    #########
+    # resampled frontier
+    #########
+    resample = result['resampled']
+    if resample is not None:
+        st.title('Resampled weights')
+        st.image(resample['weights_png'])
+        st.dataframe(pd.DataFrame({'Weight': resample['weights'],
+                                   f'{options.RESAMPLE_BAND[0]}%': resample['low'],
+                                   f'{options.RESAMPLE_BAND[1]}%': resample['high'],
+                                   'Std': resample['std']}))
+        expected_annual_return, annual_volatility, sharpe_ratio = resample['performance']
+        c1, c2, c3 = st.columns(3)
+        c1.metric(label="Expected annual return (resampled)",
+                  value=str(np.round(expected_annual_return*100,2))+'%')
+        c2.metric(label="Annual volatility",
+                  value=str(np.round(annual_volatility*100,2))+'%')
+        c3.metric(label="Sharpe ratio",
+                  value=np.round(sharpe_ratio,2))
+        if resample['failures']:
+            st.caption(f'{len(resample["failures"])} bootstrap samples could not be solved')
+
+    #########
+    # walk-forward backtest
+    #########
+    backtest_result = result['backtest']
+    if backtest_result is not None:
+        st.title('Walk-forward backtest')
+        summary = backtest_result['summary']
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric(label="Annual return (out of sample)",
+                  value=str(np.round(summary['annual_return']*100,2))+'%')
+        c2.metric(label="Annual volatility",
+                  value=str(np.round(summary['annual_volatility']*100,2))+'%')
+        c3.metric(label="Max drawdown",
+                  value=str(np.round(summary['max_drawdown']*100,2))+'%')
+        c4.metric(label="Average turnover",
+                  value=str(np.round(summary['average_turnover']*100,2))+'%')
+        st.line_chart(backtest_result['equity'])
+
+        if st.session_state['debug_info'] == True:
+            st.write(backtest_result['weights'])
+            st.write(backtest_result['failures'])
@@ -0,0 +1,17 @@
+#######################
+# Configs
+#######################
+# choices and defaults the optimization page shows before 'Optimize' is pressed,
+# here so that listing them doesn't import the optimizer stack (pypfopt, cvxpy)
+
+# rebalance frequency -> pandas period of backtest.walk_forward
+REBALANCE_FREQUENCIES = {'week': 'W',
+                         'month': 'M',
+                         'quarter': 'Q',
+                         'year': 'Y'}
+
+# bootstrap samples of resampled.resample
+RESAMPLE_SAMPLES = 200
+
+# weight percentiles of the resampled confidence band
+RESAMPLE_BAND = (5, 95)
@@ -0,0 +1,117 @@
+#######################
+# Imports
+#######################
+import numpy as np
+import pandas as pd
+
+#######################
+# Configs
+#######################
+DTYPES = {'float64': np.float64,
+          'float32': np.float32}
+
+
+# ================================================
+# (field x ticker x time) price panel
+# ================================================
+
+class PricePanel:
+    # one contiguous array for all fields and tickers, every (field, ticker) series
+    # is contiguous in time; fields and tickers are looked up in dicts and every
+    # accessor returns a view of the array (or a frame on one), never a copy,
+    # except for a subset of tickers (or of fields out of panel order) which copies just those rows
+
+    def __init__(self, data, fields, tickers, dates):
+        self.data = data
+        self.fields = list(fields)
+        self.tickers = list(tickers)
+        self.dates = pd.DatetimeIndex(dates, name='Date')
+        self._field_positions = {field: i for i, field in enumerate(self.fields)}
+        self._ticker_positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    @classmethod
+    def empty_panel(cls, dtype=np.float64):
+        return cls(np.empty((0, 0, 0), dtype=dtype), [], [], [])
+
+    @classmethod
+    def from_frame(cls, prices, dtype=np.float64):
+        # (field, ticker) frame like price_store.load_prices -> panel (copies once)
+        if prices.empty:
+            return cls.empty_panel(dtype)
+        fields = list(prices.columns.get_level_values(0).unique())
+        tickers = list(prices.columns.get_level_values(1).unique())
+        data = np.full((len(fields), len(tickers), len(prices)), np.nan, dtype=dtype)
+        for i, field in enumerate(fields):
+            data[i] = prices[field].reindex(columns=tickers).to_numpy(dtype=dtype).T
+        return cls(data, fields, tickers, prices.index)
+
+    # ---------- shape ----------
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def size(self):
+        return self.data.size
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def empty(self):
+        return self.data.size == 0
+
+    def __contains__(self, ticker):
+        return ticker in self._ticker_positions
+
+    # ---------- numpy views ----------
+
+    def _ticker_rows(self, tickers):
+        # slice(None) for all tickers in panel order (a view), positions otherwise
+        if tickers is None or list(tickers) == self.tickers:
+            return slice(None)
+        return [self._ticker_positions[t] for t in tickers]
+
+    def block(self, field, tickers=None):
+        # (time x ticker) of one field, a transposed view for all tickers,
+        # tickers not in the panel are NaN columns as with DataFrame.reindex
+        values = self.data[self._field_positions[field]]
+        if tickers is not None and any(t not in self._ticker_positions for t in tickers):
+            block = np.full((len(tickers), len(self.dates)), np.nan, dtype=self.dtype)
+            for i, ticker in enumerate(tickers):
+                if ticker in self._ticker_positions:
+                    block[i] = values[self._ticker_positions[ticker]]
+            return block.T
+        return values[self._ticker_rows(tickers)].T
+
+    # ---------- pandas on the same memory ----------
+
+    def frame(self, field, tickers=None):
+        # (time x ticker) frame of one field, what prices[field] was on the MultiIndex frame
+        tickers = self.tickers if tickers is None else list(tickers)
+        return pd.DataFrame(self.block(field, tickers), index=self.dates, columns=tickers, copy=False)
+
+    def ticker_frame(self, ticker, fields=None):
+        # (time x field) of one ticker, a view when the fields are consecutive in panel order
+        fields = self.fields if fields is None else list(fields)
+        rows = [self._field_positions[f] for f in fields]
+        if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+            rows = slice(rows[0], rows[0] + len(rows))
+        return pd.DataFrame(self.data[rows, self._ticker_positions[ticker]].T,
+                            index=self.dates, columns=fields, copy=False)
+
+    def to_frame(self):
+        # (field, ticker) MultiIndex frame like yf.download, one block on the panel's memory
+        if self.empty:
+            return pd.DataFrame()
+        n_fields, n_tickers, n_dates = self.data.shape
+        return pd.DataFrame(self.data.reshape(n_fields * n_tickers, n_dates).T,
+                            index=self.dates,
+                            columns=pd.MultiIndex.from_product([self.fields, self.tickers]),
+                            copy=False)
@@ -0,0 +1,233 @@
+#######################
+# Imports
+#######################
+import os
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pypfopt.discrete_allocation import get_latest_prices
+
+import price_store
+import frontier
+import risk_cache
+import covariance
+import tracing
+import allocation
+import jobs
+
+#######################
+# Configs
+#######################
+TARGETS = ['Max Sharpe',
+           'Efficient risk',
+           'Efficient return',
+           'Minimum volatility']
+
+RISK_MODELS = covariance.RISK_MODELS
+
+ALLOCATION_METHODS = allocation.METHODS
+
+# cached frontiers are re-solved in place, one thread at a time (background jobs run in threads)
+_frontier_lock = threading.Lock()
+
+
+# ================================================
+# one portfolio, no streamlit
+# ================================================
+
+def solve_target(ef_frontier, target, risk_free_rate=0.02, target_volatility=0.02, target_return=0.02):
+    if target == 'Max Sharpe':
+        return ef_frontier.max_sharpe(risk_free_rate)
+    elif target == 'Efficient risk':
+        return ef_frontier.efficient_risk(target_volatility)
+    elif target == 'Efficient return':
+        return ef_frontier.efficient_return(target_return)
+    elif target == 'Minimum volatility':
+        return ef_frontier.min_volatility()
+    raise ValueError(f'Unknown optimization target: {target}')
+
+
+def optimize(prices,
+             target='Max Sharpe',
+             risk_free_rate=0.02,
+             target_volatility=0.02,
+             target_return=0.02,
+             amount_to_invest=20000,
+             frontier_points=frontier.DEFAULT_POINTS,
+             risk_model='sample_cov',
+             risk_model_kwargs=None,
+             allocation_method='lp',
+             portfolio_values=None):
+    # prices -> mu/Sigma -> target -> weights -> performance -> discrete allocation
+    # prices are adjusted closes, one column per ticker
+    # every stage is a tracing span of the caller's trace and a checkpoint of the caller's job
+    # portfolio_values (a list of account sizes) adds 'accounts', the allocation of every one of them
+    jobs.checkpoint(0.1, 'estimation')
+    with tracing.span('estimation', rows=prices.size):
+        prices_fingerprint = risk_cache.price_fingerprint(prices)
+        mu = risk_cache.return_model(prices, 'mean_historical_return', fingerprint=prices_fingerprint)
+        Sigma = risk_cache.risk_matrix(prices, risk_model, fingerprint=prices_fingerprint,
+                                       **(risk_model_kwargs or {}))
+
+    jobs.checkpoint(0.4, 'frontier')
+    with _frontier_lock:
+        with tracing.span('frontier', rows=len(mu)):
+            ef_frontier = frontier.get_frontier(mu, Sigma, points=frontier_points)
+        jobs.checkpoint(0.7, 'target solve')
+        with tracing.span('target solve', rows=len(mu)):
+            weights = solve_target(ef_frontier, target, risk_free_rate, target_volatility, target_return)
+            performance = ef_frontier.portfolio_performance(weights, risk_free_rate=risk_free_rate)
+
+    jobs.checkpoint(0.8, 'allocation')
+    with tracing.span('allocation', rows=len(weights)):
+        latest_prices = get_latest_prices(prices)
+        shares, leftover = allocation.allocate(weights, latest_prices, amount_to_invest, method=allocation_method)
+
+    accounts = None
+    if portfolio_values is not None:
+        with tracing.span('batch allocation', rows=len(portfolio_values)):
+            accounts = allocation.allocate_batch(weights, latest_prices, portfolio_values,
+                                                 method=allocation_method, Sigma=Sigma)
+
+    return {'mu': mu,
+            'Sigma': Sigma,
+            'frontier': ef_frontier,
+            'weights': weights,
+            'cleaned_weights': ef_frontier.clean_weights(weights),
+            'performance': performance,
+            'latest_prices': latest_prices,
+            'allocation': shares,
+            'leftover': leftover,
+            'accounts': accounts}
+
+
+def load_and_optimize(tickers, start=None, end=None, refresh=True, **kwargs):
+    with tracing.span('download') as download:
+        prices = price_store.load_prices(tickers, start=start, end=end, refresh=refresh)['Adj Close']
+        download.rows = prices.size
+    return optimize(prices, **kwargs)
+
+
+# ================================================
+# many baskets over a process pool
+# ================================================
+
+# adjusted closes of the whole batch, set once per worker process
+_shared_prices = None
+
+
+def _init_worker(prices):
+    global _shared_prices
+    _shared_prices = prices
+
+
+def _optimize_basket(task):
+    basket_id, tickers, params = task
+    row = {'basket': basket_id, 'tickers': list(tickers)}
+    try:
+        prices = _shared_prices.loc[:, list(tickers)].dropna(how='all')
+        result = optimize(prices, **params)
+        expected_annual_return, annual_volatility, sharpe_ratio = result['performance']
+        row.update({'weights': [float(result['weights'][t]) for t in tickers],
+                    'shares': [int(result['allocation'].get(t, 0)) for t in tickers],
+                    'expected_annual_return': expected_annual_return,
+                    'annual_volatility': annual_volatility,
+                    'sharpe_ratio': sharpe_ratio,
+                    'leftover': float(result['leftover']),
+                    'error': None})
+    except Exception as e:
+        row.update({'weights': None,
+                    'shares': None,
+                    'expected_annual_return': np.nan,
+                    'annual_volatility': np.nan,
+                    'sharpe_ratio': np.nan,
+                    'leftover': np.nan,
+                    'error': f'{type(e).__name__}: {e}'})
+    return row
+
+
+def optimize_baskets(prices, baskets, workers=None, chunksize=8, **params):
+    # prices: adjusted closes of every ticker used by the baskets,
+    # baskets: list of ticker lists, params: arguments of optimize()
+    # one row per basket, failures are reported in the 'error' column
+    tasks = [(i, list(tickers), params) for i, tickers in enumerate(baskets)]
+    if workers == 1:
+        _init_worker(prices)
+        rows = [_optimize_basket(task) for task in tasks]
+    else:
+        # the price block goes to every worker once, not with every task
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(prices,)) as executor:
+            rows = list(executor.map(_optimize_basket, tasks, chunksize=chunksize))
+    return pd.DataFrame(rows)
+
+
+def read_baskets(path):
+    # one basket per line, tickers separated by commas or spaces
+    baskets = []
+    with open(path) as f:
+        for line in f:
+            tickers = line.replace(',', ' ').split()
+            if tickers:
+                baskets.append(tickers)
+    return baskets
+
+
+# ================================================
+# command line
+# ================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimize many baskets of tickers')
+    parser.add_argument('baskets', help='text file, one basket per line')
+    parser.add_argument('-o', '--output', default='optimization_results.parquet')
+    parser.add_argument('--target', choices=TARGETS, default='Max Sharpe')
+    parser.add_argument('--risk-free-rate', type=float, default=0.02)
+    parser.add_argument('--target-volatility', type=float, default=0.02)
+    parser.add_argument('--target-return', type=float, default=0.02)
+    parser.add_argument('--amount', type=float, default=20000)
+    parser.add_argument('--allocation', choices=ALLOCATION_METHODS, default='lp',
+                        help='largest_remainder skips the integer LP of every basket')
+    parser.add_argument('--points', type=int, default=frontier.DEFAULT_POINTS,
+                        help='points on the solved frontier of every basket')
+    parser.add_argument('--risk-model', choices=RISK_MODELS, default='sample_cov')
+    parser.add_argument('--float32', action='store_true',
+                        help='build the chunked risk models in float32')
+    parser.add_argument('--memory-budget', type=int, default=covariance.MEMORY_BUDGET,
+                        help='working memory of the chunked risk models, bytes')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no-refresh', action='store_true', help='use the price store as it is')
+    args = parser.parse_args(argv)
+
+    baskets = read_baskets(args.baskets)
+    tickers = sorted({t for basket in baskets for t in basket})
+    prices = price_store.load_prices(tickers, start=args.start, end=args.end,
+                                     refresh=not args.no_refresh)['Adj Close']
+
+    risk_model_kwargs = None
+    if args.risk_model in covariance.METHODS:
+        risk_model_kwargs = {'dtype': 'float32' if args.float32 else 'float64',
+                             'memory_budget': args.memory_budget}
+
+    results = optimize_baskets(prices, baskets,
+                               workers=args.workers,
+                               target=args.target,
+                               risk_free_rate=args.risk_free_rate,
+                               target_volatility=args.target_volatility,
+                               target_return=args.target_return,
+                               amount_to_invest=args.amount,
+                               allocation_method=args.allocation,
+                               frontier_points=args.points,
+                               risk_model=args.risk_model,
+                               risk_model_kwargs=risk_model_kwargs)
+    results.to_parquet(args.output)
+    print(f'{len(results)} baskets, {results["error"].notna().sum()} failed -> {args.output}')
+
+
+if __name__ == '__main__':
+    main()
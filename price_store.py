@@ -0,0 +1,329 @@
+#######################
+# Imports
+#######################
+import os
+import threading
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import downloader
+import providers
+import shared_prices
+import panel
+
+#######################
+# Configs
+#######################
+# one parquet file per ticker lives here, one store per market data provider
+STORE_DIR = os.environ.get('PRICE_STORE_DIR', providers.get_provider().data_path('prices'))
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+# a daily bar is final this long after the close of its session (late prints, adjusted close)
+MARKET_TIMEZONE = 'America/New_York'
+MARKET_CLOSE = dt.time(16, 0)
+SETTLE_DELAY = pd.Timedelta(minutes=30)
+
+
+# ================================================
+# reading and writing of a single ticker
+# ================================================
+
+def _ticker_path(ticker, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f'{ticker}.parquet')
+
+
+def slice_dates(df, start=None, end=None):
+    # binary search on a sorted DatetimeIndex instead of scanning every row,
+    # both ends are inclusive
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    return df.loc[start:end]
+
+
+def read_ticker(ticker, start=None, end=None, store_dir=STORE_DIR):
+    # stored bars of one ticker or None if it was never downloaded,
+    # the date filter is pushed down into the parquet reader
+    path = _ticker_path(ticker, store_dir)
+    if not os.path.exists(path):
+        return None
+    filters = []
+    if start is not None:
+        filters.append(('Date', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('Date', '<=', pd.Timestamp(end)))
+    df = pd.read_parquet(path, filters=filters or None)
+    return slice_dates(df, start, end)
+
+
+def last_stored_date(ticker, store_dir=STORE_DIR):
+    # read from the parquet footer statistics, no data pages are touched
+    path = _ticker_path(ticker, store_dir)
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_metadata(path)
+    if metadata.num_rows == 0:
+        return None
+    column = metadata.schema.names.index('Date')
+    return max(pd.Timestamp(metadata.row_group(i).column(column).statistics.max)
+               for i in range(metadata.num_row_groups))
+
+
+def write_ticker(ticker, df, store_dir=STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    # write to a temp file first so a crash never leaves a broken parquet behind
+    path = _ticker_path(ticker, store_dir)
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _session_end(date):
+    # when the bar of date is final, tz-aware
+    return (pd.Timestamp.combine(pd.Timestamp(date).date(), MARKET_CLOSE).tz_localize(MARKET_TIMEZONE)
+            + SETTLE_DELAY)
+
+
+def _completed(df):
+    # without the bar of a session still in progress: its close isn't final yet
+    now = pd.Timestamp.now(tz=MARKET_TIMEZONE)
+    if now >= _session_end(now):
+        return df
+    return df[df.index < now.normalize().tz_localize(None)]
+
+
+def _normalize(df):
+    # provider output -> sorted tz-naive DatetimeIndex with the FIELDS columns,
+    # completed sessions only
+    df = df.loc[:, [c for c in FIELDS if c in df.columns]]
+    df.index = pd.DatetimeIndex(df.index)
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    df.index.name = 'Date'
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    return _completed(df.dropna(how='all'))
+
+
+def _download(ticker, start=None):
+    frames, failures = providers.get_provider().history([ticker], start=start)
+    if ticker not in frames:
+        raise downloader.FetchError(failures.at[ticker, 'error'])
+    return _normalize(frames[ticker])
+
+
+# ================================================
+# incremental refresh
+# ================================================
+
+def _is_fresh(ticker, last_date, store_dir=STORE_DIR):
+    # nothing to fetch if we already have the last completed business day
+    # or the file was already refreshed today (holidays, halted tickers);
+    # a bar of today is final only if the file was written after its session ended
+    today = pd.Timestamp(dt.date.today())
+    last_business_day = today - pd.offsets.BDay(1)
+    mtime = os.path.getmtime(_ticker_path(ticker, store_dir))
+    if last_date >= today:
+        return pd.Timestamp(mtime, unit='s', tz='UTC') >= _session_end(last_date)
+    if last_date >= last_business_day:
+        return True
+    return dt.datetime.fromtimestamp(mtime).date() == today.date()
+
+
+def _merge(ticker, new, last_date, store_dir=STORE_DIR):
+    # writes freshly downloaded bars into the store, returns True if something was written
+    # first time: full history
+    if last_date is None:
+        if new.empty:
+            return False
+        write_ticker(ticker, new, store_dir)
+        return True
+
+    stored = read_ticker(ticker, store_dir=store_dir)
+
+    if new.empty:
+        completed = _completed(stored)
+        if len(completed) < len(stored):
+            # an unfinished bar stored by an earlier refresh, drop it
+            write_ticker(ticker, completed, store_dir)
+            return True
+        # touch the file so that the next rerun today doesn't try again
+        os.utime(_ticker_path(ticker, store_dir))
+        return False
+
+    # a dividend or split since the last refresh rescales the whole adjusted history,
+    # the overlapping bar tells us by how much
+    if last_date in new.index and 'Adj Close' in new.columns:
+        old_ratio = stored.at[last_date, 'Adj Close'] / stored.at[last_date, 'Close']
+        new_ratio = new.at[last_date, 'Adj Close'] / new.at[last_date, 'Close']
+        if pd.notna(old_ratio) and pd.notna(new_ratio) and abs(new_ratio / old_ratio - 1) > 1e-9:
+            stored = stored.copy()
+            stored['Adj Close'] = stored['Adj Close'] * (new_ratio / old_ratio)
+
+    df = pd.concat([stored[stored.index < new.index[0]], new])
+    write_ticker(ticker, df, store_dir)
+    return True
+
+
+# one lock per stored file, held only while it is merged and written:
+# downloads never wait for each other, two sessions refreshing the same ticker
+# may download it twice but write it one after the other
+_ticker_locks = {}
+_ticker_locks_lock = threading.Lock()
+
+
+def _ticker_lock(ticker, store_dir=STORE_DIR):
+    with _ticker_locks_lock:
+        return _ticker_locks.setdefault((store_dir, ticker), threading.Lock())
+
+
+def _merge_locked(ticker, new, store_dir=STORE_DIR):
+    # _merge under the ticker's lock, against the file as it is now:
+    # another session may have written it since the download started,
+    # new still overlaps it (it starts at the last date seen before the download)
+    with _ticker_lock(ticker, store_dir):
+        last_date = last_stored_date(ticker, store_dir)
+        if last_date is not None and _is_fresh(ticker, last_date, store_dir):
+            return False
+        return _merge(ticker, new, last_date, store_dir)
+
+
+def refresh_ticker(ticker, store_dir=STORE_DIR):
+    # brings the stored file up to date, returns True if something was written
+    last_date = last_stored_date(ticker, store_dir)
+    if last_date is not None and _is_fresh(ticker, last_date, store_dir):
+        return False
+    # fetch from the last stored bar (inclusive) so that we have one overlapping bar
+    new = _download(ticker, start=None if last_date is None else last_date.date())
+    return _merge_locked(ticker, new, store_dir)
+
+
+def refresh_tickers(tickers, store_dir=STORE_DIR, **fetch_kwargs):
+    # brings many files up to date with one history() call of the provider
+    # (concurrent downloads for yahoo, see downloader.fetch_many),
+    # returns the failure report, whatever succeeded is written
+    # no lock is held while downloading, see _merge_locked
+    last_dates, starts = {}, {}
+    for ticker in tickers:
+        last_date = last_stored_date(ticker, store_dir)
+        if last_date is not None and _is_fresh(ticker, last_date, store_dir):
+            continue
+        last_dates[ticker] = last_date
+        starts[ticker] = None if last_date is None else last_date.date()
+
+    frames, failures = providers.get_provider().history(list(starts), start=starts, **fetch_kwargs)
+
+    missing = []
+    for ticker, new in frames.items():
+        new = _normalize(new)
+        _merge_locked(ticker, new, store_dir)
+        if new.empty and last_dates[ticker] is None:
+            missing.append({'ticker': ticker, 'error': 'no price data', 'attempts': 1, 'seconds': 0.0})
+    if missing:
+        failures = pd.concat([failures, downloader.failure_report(missing)])
+    return failures
+
+
+# ================================================
+# stored tickers shared in memory by all sessions
+# ================================================
+# every file is read once per version (mtime and size) into read-only arrays
+# of shared_prices.get_cache(), sessions get panels and frames on them without copying
+
+def _file_version(ticker, store_dir=STORE_DIR):
+    try:
+        stat = os.stat(_ticker_path(ticker, store_dir))
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _ticker_arrays(ticker, store_dir):
+    df = read_ticker(ticker, store_dir=store_dir)
+    arrays = {'dates': shared_prices.freeze(df.index.to_numpy(dtype='datetime64[ns]')),
+              'fields': list(df.columns),
+              'values': shared_prices.freeze(np.ascontiguousarray(df.to_numpy(dtype=np.float64)))}
+    return arrays, arrays['dates'].nbytes + arrays['values'].nbytes
+
+
+def cached_ticker(ticker, store_dir=STORE_DIR):
+    # {'dates', 'fields', 'values' (dates x fields)} of the stored file or None, all read-only
+    version = _file_version(ticker, store_dir)
+    if version is None:
+        return None
+    return shared_prices.get_cache().get(('ticker', store_dir, ticker), version,
+                                         lambda: _ticker_arrays(ticker, store_dir))
+
+
+def _window(dates, start=None, end=None):
+    # positions of [start, end] in sorted dates, both ends inclusive
+    i = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), 'left'))
+    j = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), 'right'))
+    return i, j
+
+
+def _panel(tickers, start, end, store_dir, dtype):
+    # panel.PricePanel of the window on the union of the dates, one read-only (field x ticker x time) array
+    windows = {}
+    for ticker in tickers:
+        arrays = cached_ticker(ticker, store_dir)
+        if arrays is None:
+            continue
+        i, j = _window(arrays['dates'], start, end)
+        if j > i:
+            windows[ticker] = (arrays, i, j)
+    if not windows:
+        return panel.PricePanel.empty_panel(dtype), 0
+
+    tickers = sorted(windows)
+    fields = sorted({f for arrays, _, _ in windows.values() for f in arrays['fields']})
+    dates = np.unique(np.concatenate([arrays['dates'][i:j] for arrays, i, j in windows.values()]))
+    data = np.full((len(fields), len(tickers), len(dates)), np.nan, dtype=dtype)
+    for k, ticker in enumerate(tickers):
+        arrays, i, j = windows[ticker]
+        columns = np.searchsorted(dates, arrays['dates'][i:j])
+        for position, field in enumerate(arrays['fields']):
+            data[fields.index(field), k, columns] = arrays['values'][i:j, position]
+
+    prices = panel.PricePanel(shared_prices.freeze(data), fields, tickers, dates)
+    return prices, data.nbytes + dates.nbytes
+
+
+def cached_panel(tickers, start=None, end=None, store_dir=STORE_DIR, dtype='float64'):
+    # sessions asking for the same tickers, window and dtype share one panel,
+    # it is rebuilt when any of the files changed
+    tickers = tuple(sorted(set(tickers)))
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    version = tuple(_file_version(ticker, store_dir) for ticker in tickers)
+    return shared_prices.get_cache().get(('panel', store_dir, tickers, start, end, dtype), version,
+                                         lambda: _panel(tickers, start, end, store_dir, panel.DTYPES[dtype]))
+
+
+# ================================================
+# what the pages use
+# ================================================
+
+def load_panel(tickers, start=None, end=None, refresh=True, store_dir=STORE_DIR, dtype='float64', **fetch_kwargs):
+    # (panel.PricePanel, failure report), the panel is shared with every other caller
+    # of the same tickers, window and dtype: read-only
+    # tickers that failed to refresh are served from the store if they were stored before
+    failures = downloader.failure_report([])
+    if refresh:
+        failures = refresh_tickers(list(tickers), store_dir, **fetch_kwargs)
+    return cached_panel(tickers, start, end, store_dir, dtype), failures
+
+
+def load_prices(tickers, start=None, end=None, refresh=True, store_dir=STORE_DIR, **fetch_kwargs):
+    # same layout as yf.download for several tickers:
+    # DatetimeIndex 'Date' and (field, ticker) MultiIndex columns, all float64,
+    # a read-only frame on the shared panel
+    # the failure report is in df.attrs['failures']
+    prices, failures = load_panel(tickers, start, end, refresh, store_dir, **fetch_kwargs)
+    df = prices.to_frame()
+    df.attrs['failures'] = failures
+    return df
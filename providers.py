@@ -0,0 +1,254 @@
+#######################
+# Imports
+#######################
+import os
+import re
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import downloader
+import lazy_imports
+
+# pandas datareader to download tickers from nasdaq, only the yahoo provider needs it
+pdr = lazy_imports.lazy_import('pandas_datareader')
+
+#######################
+# Configs
+#######################
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# 'yahoo', 'replay:<directory>' or 'synthetic[:<tickers>x<years>[:<seed>]]'
+PROVIDER = os.environ.get('MARKET_DATA_PROVIDER', 'yahoo')
+
+TRADING_DAYS = 252
+
+# columns of pandas_datareader's nasdaq_trader directory
+SYMBOL_COLUMNS = ['Nasdaq Traded', 'Security Name', 'Listing Exchange', 'Market Category',
+                  'ETF', 'Round Lot Size', 'Test Issue', 'Financial Status',
+                  'CQS Symbol', 'NASDAQ Symbol', 'NextShares']
+
+
+# ================================================
+# interface
+# ================================================
+
+class MarketDataProvider:
+    # symbol directory and daily OHLCV history
+    name = None
+
+    def symbols(self):
+        # nasdaq_trader layout: index 'Symbol', SYMBOL_COLUMNS
+        raise NotImplementedError
+
+    def history(self, tickers, start=None, **kwargs):
+        # same contract as downloader.fetch_many:
+        # ({ticker: daily bars} of everything available, failure report),
+        # start is one date or {ticker: date}, None means full history
+        raise NotImplementedError
+
+    def data_path(self, name):
+        # caches derived from this provider's data (price store, symbol directory)
+        # must not mix with the ones of another provider
+        if self.name == 'yahoo':
+            return os.path.join(DATA_DIR, name)
+        return os.path.join(DATA_DIR, self.name, name)
+
+
+def _starts(tickers, start):
+    return start if isinstance(start, dict) else dict.fromkeys(tickers, start)
+
+
+# ================================================
+# live data
+# ================================================
+
+class YahooProvider(MarketDataProvider):
+    name = 'yahoo'
+
+    def symbols(self):
+        return pdr.nasdaq_trader.get_nasdaq_symbols(retry_count=3, timeout=30, pause=None)
+
+    def history(self, tickers, start=None, **kwargs):
+        return downloader.fetch_many(list(tickers), start=start, **kwargs)
+
+
+# ================================================
+# offline replay of recorded data
+# ================================================
+
+class ReplayProvider(MarketDataProvider):
+    # directory with symbols.parquet and one parquet file of bars per ticker in prices/
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = 'replay-' + re.sub(r'[^0-9A-Za-z]+', '-', os.path.basename(self.path)).strip('-')
+
+    def _ticker_path(self, ticker):
+        return os.path.join(self.path, 'prices', f'{ticker}.parquet')
+
+    def symbols(self):
+        return pd.read_parquet(os.path.join(self.path, 'symbols.parquet'))
+
+    def history(self, tickers, start=None, **kwargs):
+        starts = _starts(tickers, start)
+        frames, failures = {}, []
+        for ticker in tickers:
+            path = self._ticker_path(ticker)
+            if not os.path.exists(path):
+                failures.append({'ticker': ticker, 'error': 'not in the recording',
+                                 'attempts': 1, 'seconds': 0.0})
+                continue
+            ticker_start = starts.get(ticker)
+            filters = None if ticker_start is None else [('Date', '>=', pd.Timestamp(ticker_start))]
+            frames[ticker] = pd.read_parquet(path, filters=filters)
+        return frames, downloader.failure_report(failures)
+
+
+def record(tickers, path, source=None, start=None, **kwargs):
+    # snapshot of another provider that ReplayProvider(path) plays back,
+    # returns the failure report of the source
+    source = source or get_provider()
+    os.makedirs(os.path.join(path, 'prices'), exist_ok=True)
+    source.symbols().to_parquet(os.path.join(path, 'symbols.parquet'))
+    frames, failures = source.history(list(tickers), start=start, **kwargs)
+    for ticker, df in frames.items():
+        df.to_parquet(os.path.join(path, 'prices', f'{ticker}.parquet'))
+    return failures
+
+
+# ================================================
+# synthetic data
+# ================================================
+
+class SyntheticProvider(MarketDataProvider):
+    # geometric brownian motion with one market factor, n_tickers x years of business days
+    # ending at `end` (default: last business day), the same seed gives the same data
+
+    def __init__(self, n_tickers=500, years=10, seed=0, end=None):
+        self.n_tickers = n_tickers
+        self.years = years
+        self.seed = seed
+        self.name = f'synthetic-{n_tickers}x{years:g}-{seed}'
+        if end is None:
+            end = pd.Timestamp.today().normalize() - pd.offsets.BDay(1)
+        self.dates = pd.bdate_range(end=end, periods=int(years * TRADING_DAYS), name='Date')
+        self.tickers = [f'SYN{i:0{max(4, len(str(n_tickers - 1)))}d}' for i in range(n_tickers)]
+        self._positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+        rng = np.random.default_rng([seed, 0])
+        self._market = rng.normal(0.07 / TRADING_DAYS, 0.16 / np.sqrt(TRADING_DAYS), len(self.dates))
+
+    def symbols(self):
+        n = self.n_tickers
+        df = pd.DataFrame({'Nasdaq Traded': True,
+                           'Security Name': [f'Synthetic Corp {i} - Common Stock' for i in range(n)],
+                           'Listing Exchange': 'Q',
+                           'Market Category': 'Q',
+                           'ETF': False,
+                           'Round Lot Size': 100.0,
+                           'Test Issue': False,
+                           'Financial Status': 'N',
+                           'CQS Symbol': None,
+                           'NASDAQ Symbol': self.tickers,
+                           'NextShares': False},
+                          index=pd.Index(self.tickers, name='Symbol'))
+        return df[SYMBOL_COLUMNS]
+
+    def bars(self, ticker):
+        # full history of one ticker, generated from (seed, ticker position) only
+        position = self._positions[ticker]
+        rng = np.random.default_rng([self.seed, position + 1])
+        n = len(self.dates)
+
+        beta = rng.uniform(0.5, 1.5)
+        drift = rng.normal(0.03, 0.05) / TRADING_DAYS
+        volatility = rng.uniform(0.15, 0.6) / np.sqrt(TRADING_DAYS)
+        log_returns = drift + beta * self._market + rng.normal(0, volatility, n) - 0.5 * volatility ** 2
+
+        close = rng.uniform(5, 500) * np.exp(np.cumsum(log_returns))
+        previous = np.r_[close[0], close[:-1]]
+        open_ = previous * np.exp(rng.normal(0, volatility / 4, n))
+        high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, volatility / 2, n)))
+        low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, volatility / 2, n)))
+        volume = np.round(rng.lognormal(13, 1) * rng.lognormal(0, 0.5, n))
+
+        return pd.DataFrame({'Open': open_,
+                             'High': high,
+                             'Low': low,
+                             'Close': close,
+                             'Adj Close': close,
+                             'Volume': volume},
+                            index=self.dates)
+
+    def history(self, tickers, start=None, **kwargs):
+        starts = _starts(tickers, start)
+        frames, failures = {}, []
+        for ticker in tickers:
+            if ticker not in self._positions:
+                failures.append({'ticker': ticker, 'error': 'unknown synthetic ticker',
+                                 'attempts': 1, 'seconds': 0.0})
+                continue
+            df = self.bars(ticker)
+            ticker_start = starts.get(ticker)
+            if ticker_start is not None:
+                df = df.loc[pd.Timestamp(ticker_start):]
+            frames[ticker] = df
+        return frames, downloader.failure_report(failures)
+
+
+# ================================================
+# the provider of this process
+# ================================================
+
+def make_provider(spec):
+    kind, _, arguments = spec.partition(':')
+    if kind == 'yahoo':
+        return YahooProvider()
+    elif kind == 'replay':
+        return ReplayProvider(arguments)
+    elif kind == 'synthetic':
+        size, _, seed = arguments.partition(':')
+        n_tickers, _, years = size.partition('x')
+        return SyntheticProvider(n_tickers=int(n_tickers or 500),
+                                 years=float(years or 10),
+                                 seed=int(seed or 0))
+    raise ValueError(f'Unknown market data provider: {spec}')
+
+
+# one provider per process, set by MARKET_DATA_PROVIDER
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = make_provider(PROVIDER)
+    return _provider
+
+
+# ================================================
+# command line
+# ================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record market data for offline replay')
+    parser.add_argument('path', help='directory of the recording')
+    parser.add_argument('--source', default=PROVIDER, help='provider to record, same format as MARKET_DATA_PROVIDER')
+    parser.add_argument('--tickers', nargs='*', default=None, help='default: the whole symbol directory')
+    parser.add_argument('--start', default=None)
+    args = parser.parse_args(argv)
+
+    source = make_provider(args.source)
+    tickers = args.tickers
+    if not tickers:
+        # same filter as the pages (symbols imports this module)
+        import symbols
+        tickers = list(symbols.filter_symbols(source.symbols()).index)
+    failures = record(tickers, args.path, source=source, start=args.start)
+    print(f'{len(tickers) - len(failures)} of {len(tickers)} tickers recorded -> {args.path}')
+
+
+if __name__ == '__main__':
+    main()
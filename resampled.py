@@ -0,0 +1,208 @@
+#######################
+# Imports
+#######################
+import os
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from pypfopt.exceptions import OptimizationError
+
+import frontier
+import options
+import pipeline
+import risk_cache
+import jobs
+
+#######################
+# Configs
+#######################
+TRADING_DAYS = 252
+
+# bootstrap samples of the return history
+DEFAULT_SAMPLES = options.RESAMPLE_SAMPLES
+
+# processes solving the samples, 1 solves them in the calling thread
+WORKERS = int(os.environ.get('RESAMPLE_WORKERS', os.cpu_count() or 1))
+
+# samples per task sent to a worker: fewer round trips, still a smooth progress bar;
+# the samples of a task warm-start each other, every task starts from a new frontier
+TASK_SAMPLES = 8
+
+# weight percentiles of the confidence band
+BAND = options.RESAMPLE_BAND
+
+# the frontier of every sample only warm-starts the objective, a coarse grid is enough
+FRONTIER_POINTS = 10
+
+# how many resampled results are kept
+CACHE_SIZE = 16
+
+_cache = OrderedDict()
+
+
+# ================================================
+# one bootstrap sample
+# ================================================
+
+def bootstrap_rows(n_rows, block, rng):
+    # row positions of a moving block bootstrap of the same length,
+    # block=1 is the plain iid bootstrap, longer blocks keep volatility clustering
+    block = int(np.clip(block, 1, n_rows))
+    starts = rng.integers(0, n_rows - block + 1, size=-(-n_rows // block))
+    return (starts[:, None] + np.arange(block)).ravel()[:n_rows]
+
+
+def estimate(returns, frequency=TRADING_DAYS):
+    # compounded mean and sample covariance, as backtest.RollingMoments on a full window
+    mu = np.expm1(np.log1p(returns).mean(axis=0) * frequency)
+    Sigma = np.cov(returns, rowvar=False) * frequency
+    return mu, np.atleast_2d(Sigma)
+
+
+def _solve_sample(returns, tickers, seed, block, target, params, ef_frontier):
+    # weights of one sample, the frontier of the previous sample is updated in place (warm start)
+    rng = np.random.default_rng(seed)
+    mu, Sigma = estimate(returns[bootstrap_rows(len(returns), block, rng)])
+    mu = pd.Series(mu, index=tickers)
+    Sigma = pd.DataFrame(Sigma, index=tickers, columns=tickers)
+    if ef_frontier is None:
+        ef_frontier = frontier.Frontier(mu, Sigma, points=FRONTIER_POINTS)
+    else:
+        ef_frontier.update(mu, Sigma)
+    weights = pipeline.solve_target(ef_frontier, target, **params)
+    return np.array([weights[t] for t in tickers]), ef_frontier
+
+
+def _solve_samples(returns, tickers, seeds, block, target, params, ef_frontier=None):
+    # (samples x assets) weights, NaN rows for samples the objective can't be solved on
+    weights = np.full((len(seeds), len(tickers)), np.nan)
+    errors = []
+    for i, seed in enumerate(seeds):
+        try:
+            weights[i], ef_frontier = _solve_sample(returns, tickers, seed, block, target, params, ef_frontier)
+        except (ValueError, OptimizationError) as e:
+            errors.append(str(e))
+    return weights, errors, ef_frontier
+
+
+# ================================================
+# workers reading the returns from shared memory
+# ================================================
+
+# returns array on the shared block and tickers, set once per worker process
+_worker = {}
+
+
+def _init_worker(name, shape, dtype, tickers):
+    memory = shared_memory.SharedMemory(name=name)
+    _worker['memory'] = memory
+    _worker['returns'] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    _worker['tickers'] = tickers
+
+
+def _worker_task(task):
+    seeds, block, target, params = task
+    weights, errors, _ = _solve_samples(_worker['returns'], _worker['tickers'], seeds, block, target, params)
+    return weights, errors
+
+
+# ================================================
+# resampled weights
+# ================================================
+
+def resample(prices,
+             target='Max Sharpe',
+             n_samples=DEFAULT_SAMPLES,
+             block=1,
+             risk_free_rate=0.02,
+             target_volatility=0.02,
+             target_return=0.02,
+             seed=0,
+             workers=WORKERS):
+    # prices: adjusted closes, one column per ticker
+    # re-estimates mu/Sigma on n_samples bootstraps of the daily returns and solves target on each,
+    # every sample has its own seed and every task of TASK_SAMPLES samples its own chain
+    # of warm starts, so the result doesn't depend on workers
+    # returns {'samples' (samples x tickers), 'weights' (mean, renormalized), 'low', 'high' (BAND),
+    #          'std', 'failures' (messages of the unsolved samples)}
+    returns_frame = prices.pct_change().dropna(how='any')
+    returns = np.ascontiguousarray(returns_frame.to_numpy(dtype=float))
+    tickers = list(returns_frame.columns)
+    if len(returns) < 2:
+        raise ValueError('Need at least two days of returns for the resampled frontier')
+
+    params = {'risk_free_rate': risk_free_rate,
+              'target_volatility': target_volatility,
+              'target_return': target_return}
+    seeds = np.random.SeedSequence(seed).spawn(n_samples)
+    weights = np.full((n_samples, len(tickers)), np.nan)
+    failures = []
+
+    if workers == 1:
+        for start in range(0, n_samples, TASK_SAMPLES):
+            jobs.checkpoint(message=f'bootstrap samples {start} of {n_samples}')
+            stop = min(start + TASK_SAMPLES, n_samples)
+            weights[start:stop], errors, _ = _solve_samples(returns, tickers, seeds[start:stop], block,
+                                                            target, params)
+            failures += errors
+    else:
+        # the returns are copied once into shared memory, every worker maps the same block;
+        # spawned workers, as the caller may be a thread of the streamlit server
+        memory = shared_memory.SharedMemory(create=True, size=returns.nbytes)
+        try:
+            np.ndarray(returns.shape, dtype=returns.dtype, buffer=memory.buf)[:] = returns
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_worker,
+                                           initargs=(memory.name, returns.shape, returns.dtype, tickers))
+            try:
+                futures = {executor.submit(_worker_task, (seeds[start:start + TASK_SAMPLES], block, target, params)):
+                           start
+                           for start in range(0, n_samples, TASK_SAMPLES)}
+                for done, future in enumerate(as_completed(futures)):
+                    jobs.checkpoint(message=f'bootstrap samples {done * TASK_SAMPLES} of {n_samples}')
+                    start = futures[future]
+                    task_weights, errors = future.result()
+                    weights[start:start + len(task_weights)] = task_weights
+                    failures += errors
+            finally:
+                executor.shutdown(cancel_futures=True)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    solved = weights[~np.isnan(weights).any(axis=1)]
+    if not len(solved):
+        raise ValueError('The objective could not be solved on any bootstrap sample: ' + failures[0])
+    mean = solved.mean(axis=0)
+    index = pd.Index(tickers)
+    return {'samples': pd.DataFrame(solved, columns=tickers),
+            'weights': pd.Series(mean / mean.sum(), index=index),
+            'low': pd.Series(np.percentile(solved, BAND[0], axis=0), index=index),
+            'high': pd.Series(np.percentile(solved, BAND[1], axis=0), index=index),
+            'std': pd.Series(solved.std(axis=0), index=index),
+            'failures': failures}
+
+
+def cached_resample(prices, **kwargs):
+    # same prices and arguments -> same samples, workers don't change the result
+    key = (risk_cache.price_fingerprint(prices),
+           tuple(sorted((k, repr(v)) for k, v in kwargs.items() if k != 'workers')))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    result = resample(prices, **kwargs)
+    _cache[key] = result
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
+
+
+def clear_cache():
+    _cache.clear()
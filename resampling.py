@@ -0,0 +1,119 @@
+#######################
+# Imports
+#######################
+import re
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import panel
+
+#######################
+# Configs
+#######################
+# names used in the candles selectbox -> pandas period aliases
+FREQUENCIES = {'day': 'D',
+               'week': 'W',
+               'month': 'M',
+               'quarter': 'Q',
+               'year': 'Y'}
+
+OHLC_FIELDS = ['Open', 'High', 'Low', 'Close']
+
+# how many resampled panels are kept
+CACHE_SIZE = 32
+
+_cache = OrderedDict()
+
+
+# ================================================
+# bucketing of the dates
+# ================================================
+
+def _buckets(index, freq):
+    # position of the first bar of every bucket and the date of every bucket,
+    # bars are sorted by date so a bucket is a contiguous run of equal codes
+    n_days = re.fullmatch(r'(\d+)\s*(?:D|days?)', str(freq))
+    if n_days:
+        # N-day bars counted from the first bar of the range
+        n = int(n_days.group(1))
+        origin = index[0].normalize()
+        codes = np.asarray((index.normalize() - origin).days) // n
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        return starts, origin + pd.to_timedelta(codes[starts] * n, unit='D')
+
+    periods = index.to_period(FREQUENCIES.get(freq, freq))
+    codes = periods.asi8
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    return starts, periods[starts].start_time
+
+
+# ================================================
+# resampling
+# ================================================
+
+def _resample(prices, tickers, freq):
+    index = prices.dates
+    starts, labels = _buckets(index, freq)
+    rows = np.arange(len(index))[:, None]
+
+    # (time x ticker) views of the panel for every field, all tickers at once
+    open_, high, low, close = [prices.block(field, tickers) for field in OHLC_FIELDS]
+
+    # first and last bar with data inside every bucket for every ticker,
+    # so tickers with gaps or a later listing date get proper open/close
+    first = np.minimum.reduceat(np.where(np.isnan(open_), len(index), rows), starts, axis=0)
+    last = np.maximum.reduceat(np.where(np.isnan(close), -1, rows), starts, axis=0)
+    columns = np.arange(len(tickers))
+    bar_open = np.where(first < len(index), open_[np.minimum(first, len(index) - 1), columns], np.nan)
+    bar_close = np.where(last >= 0, close[np.maximum(last, 0), columns], np.nan)
+
+    # fmax/fmin skip the NaNs of missing bars
+    bar_high = np.fmax.reduceat(high, starts, axis=0)
+    bar_low = np.fmin.reduceat(low, starts, axis=0)
+
+    bars = np.concatenate([bar_open, bar_high, bar_low, bar_close], axis=1)
+    columns = pd.MultiIndex.from_product([OHLC_FIELDS, tickers])
+    return pd.DataFrame(bars, index=pd.DatetimeIndex(labels, name='Date'), columns=columns)
+
+
+def _fingerprint(prices):
+    # changes with any value, date, field or ticker of the panel
+    digest = hashlib.sha1()
+    digest.update(repr((prices.fields, prices.tickers)).encode())
+    digest.update(prices.dates.asi8.tobytes())
+    digest.update(np.ascontiguousarray(prices.data).data)
+    return digest.hexdigest()
+
+
+def resample_ohlc(prices, tickers, freq):
+    # OHLC bars of all tickers at frequency freq ('day', 'week', 'month', 'quarter',
+    # 'year', any pandas period alias or 'ND' for N days)
+    # prices is a panel.PricePanel or a frame with (field, ticker) columns like price_store.load_prices,
+    # result is a frame with (field, ticker) columns, the OHLC_FIELDS only
+    tickers = list(tickers)
+    if prices.empty or not tickers:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([OHLC_FIELDS, tickers]))
+
+    if not isinstance(prices, panel.PricePanel):
+        if not prices.index.is_monotonic_increasing:
+            prices = prices.sort_index()
+        prices = panel.PricePanel.from_frame(prices)
+
+    key = (tuple(tickers), _fingerprint(prices), str(freq), str(prices.dtype))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    bars = _resample(prices, tickers, freq)
+
+    _cache[key] = bars
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return bars
+
+
+def clear_cache():
+    _cache.clear()
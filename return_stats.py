@@ -0,0 +1,121 @@
+#######################
+# Imports
+#######################
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import streaming_stats
+
+#######################
+# Configs
+#######################
+PERCENTILES = [.025, .25, .5, .75, .975]
+
+# return histograms: bins between robust quantiles of all tickers' returns,
+# returns outside are counted in the first / last bin
+HISTOGRAM_BINS = 100
+HISTOGRAM_QUANTILES = (0.001, 0.999)
+
+# how many histograms are kept
+CACHE_SIZE = 32
+
+# how many return frames (tickers and first date) keep their statistics accumulator
+STATS_CACHE_SIZE = 32
+
+_cache = OrderedDict()
+_stats_cache = OrderedDict()
+
+
+# ================================================
+# what the analytics page shows, without streamlit
+# ================================================
+# adj_close: adjusted closes, one column per ticker
+
+def daily_returns(adj_close):
+    return adj_close.pct_change()
+
+
+def cumulative_returns(adj_close):
+    return (daily_returns(adj_close) + 1).cumprod()
+
+
+def distribution_table(returns):
+    # one row per ticker: describe() percentiles, kurtosis, skew, range and IQR
+    dfd = returns.describe(PERCENTILES)
+    dfk = returns.kurtosis().rename('kurtosis')
+    dfs = returns.skew().rename('skew')
+    dfd = dfd.T.join(dfk).join(dfs).drop('count', axis=1)
+    dfd['range'] = dfd['max'] - dfd['min']
+    dfd['IQR'] = dfd['75%'] - dfd['25%']
+    return dfd
+
+
+def streaming_distribution_table(returns):
+    # distribution_table from one pass over the returns, the quantiles are approximate
+    # (streaming_stats.RELATIVE_ACCURACY), after a refresh only the new rows are added
+    key = (tuple(returns.columns), returns.index[0] if len(returns) else None)
+    stats = _stats_cache.get(key)
+    if stats is not None:
+        _stats_cache.move_to_end(key)
+        try:
+            stats.update(returns)
+        except ValueError:
+            # a shorter range or revised history
+            stats = None
+    if stats is None:
+        stats = streaming_stats.ReturnStats(returns.columns).update(returns)
+        _stats_cache[key] = stats
+        if len(_stats_cache) > STATS_CACHE_SIZE:
+            _stats_cache.popitem(last=False)
+    return stats.table(PERCENTILES)
+
+
+# ================================================
+# return histograms counted on the server
+# ================================================
+
+def histogram_edges(values, bins=HISTOGRAM_BINS, quantiles=HISTOGRAM_QUANTILES):
+    # equal-width bins over the robust range of all values
+    low, high = np.nanquantile(values, quantiles)
+    if not np.isfinite(low) or high <= low:
+        low, high = (low - 0.01, low + 0.01) if np.isfinite(low) else (-0.01, 0.01)
+    return np.linspace(low, high, bins + 1)
+
+
+def return_histograms(returns, bins=HISTOGRAM_BINS, quantiles=HISTOGRAM_QUANTILES):
+    # counts of every ticker on common bins in one bincount over all tickers,
+    # index is the bin center, the payload depends on bins only, not on the history
+    values = returns.to_numpy(dtype=float)
+    edges = histogram_edges(values, bins, quantiles)
+    width = edges[1] - edges[0]
+
+    rows, columns = np.nonzero(~np.isnan(values))
+    positions = np.clip(((values[rows, columns] - edges[0]) // width).astype(np.int64), 0, bins - 1)
+    counts = np.bincount(columns * bins + positions, minlength=values.shape[1] * bins)
+
+    centers = pd.Index(edges[:-1] + width / 2, name='return')
+    return pd.DataFrame(counts.reshape(values.shape[1], bins).T, index=centers, columns=returns.columns)
+
+
+def cached_return_histograms(returns, bins=HISTOGRAM_BINS, quantiles=HISTOGRAM_QUANTILES):
+    # same key as the candle cache plus the last row, which changes with every refresh
+    if len(returns) == 0:
+        return return_histograms(returns, bins, quantiles)
+    key = (tuple(returns.columns), returns.index[0], returns.index[-1], len(returns),
+           bins, tuple(quantiles), tuple(np.nan_to_num(returns.iloc[-1].to_numpy(dtype=float))))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    counts = return_histograms(returns, bins, quantiles)
+    _cache[key] = counts
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return counts
+
+
+def clear_cache():
+    _cache.clear()
+    _stats_cache.clear()
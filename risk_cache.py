@@ -0,0 +1,111 @@
+#######################
+# Imports
+#######################
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from pypfopt import risk_models
+from pypfopt import expected_returns
+
+import covariance
+
+#######################
+# Configs
+#######################
+# how many estimates (mu or Sigma) are kept
+CACHE_SIZE = 64
+
+
+# ================================================
+# fingerprint of a price block
+# ================================================
+
+def price_fingerprint(prices):
+    # changes with any value, date or ticker of the block
+    digest = hashlib.sha1()
+    digest.update(repr(list(prices.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(prices, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# ================================================
+# LRU of estimates with hit/miss counters
+# ================================================
+
+class EstimateCache:
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        # optimization jobs of several sessions use the cache from their worker threads
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        # compute() runs outside the lock so that other keys aren't blocked
+        # the value is shared with other callers, must not be modified
+        # (a full-universe covariance is too big to copy on every hit)
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = len(self._items)
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else np.nan,
+                'size': size,
+                'maxsize': self.maxsize}
+
+
+# one cache per process, survives streamlit reruns
+cache = EstimateCache()
+
+
+def _key(kind, prices, method, kwargs, fingerprint):
+    if fingerprint is None:
+        fingerprint = price_fingerprint(prices)
+    return (kind, fingerprint, method, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+
+
+# ================================================
+# cached estimators
+# ================================================
+# same arguments as pypfopt's expected_returns.return_model / risk_models.risk_matrix,
+# plus the memory-bounded models of covariance.METHODS,
+# fingerprint can be passed when the caller already has it for this price block
+
+def return_model(prices, method='mean_historical_return', fingerprint=None, **kwargs):
+    key = _key('mu', prices, method, kwargs, fingerprint)
+    return cache.get(key, lambda: expected_returns.return_model(prices, method=method, **kwargs))
+
+
+def risk_matrix(prices, method='sample_cov', fingerprint=None, **kwargs):
+    key = _key('Sigma', prices, method, kwargs, fingerprint)
+    if method in covariance.METHODS:
+        return cache.get(key, lambda: covariance.risk_matrix(prices, method=method, **kwargs))
+    return cache.get(key, lambda: risk_models.risk_matrix(prices, method=method, **kwargs))
@@ -0,0 +1,81 @@
+#######################
+# Imports
+#######################
+import datetime as dt
+
+import streamlit as st
+
+import lazy_imports
+import jobs
+
+# the universe store (pyarrow, the price store) is imported once the screener is switched on
+universe = lazy_imports.lazy_import('universe')
+
+#######################
+# Configs
+#######################
+# the portfolio multiselect takes at most this many tickers
+MAX_TICKERS = 20
+
+
+# ================================================
+# sidebar screener feeding the portfolio multiselect
+# ================================================
+
+def sidebar(tickers):
+    # tickers: the filtered NASDAQ symbols, the options of the portfolio multiselect
+    # must run before that multiselect is created: 'Use in portfolio' sets its value
+    # an expander's body runs on every rerun, open or not: the checkbox keeps the screener
+    # (and its imports) out of the runs that don't use it
+    if not st.sidebar.checkbox('Screener', key='screener'):
+        return
+
+    with st.sidebar.container():
+        queue = jobs.get_queue()
+
+        # one ingestion of the whole universe a day, whoever starts it
+        if st.button(f'Download all {len(tickers):,} tickers', key='universe_ingest'):
+            key = jobs.job_key('universe', len(tickers), dt.date.today().isoformat())
+            job = queue.submit(universe.ingest, tuple(tickers), key=key, name='universe')
+            st.session_state['universe_job'] = job.key
+
+        job = queue.get(st.session_state['universe_job'])
+        if job is not None:
+            if not job.finished_state:
+                st.progress(job.progress)
+                st.caption(f'{job.message} ({job.seconds:.0f}s), rerun to update')
+            elif job.state == 'failed':
+                st.write(job.error)
+            elif job.state == 'done':
+                if not job.result['written']:
+                    st.warning('Too little price history was downloaded, the universe was not updated')
+                if not job.result['failures'].empty:
+                    st.caption(f'{len(job.result["failures"])} tickers could not be downloaded')
+
+        arrays = universe.load()
+        if arrays is None:
+            st.caption('No universe downloaded yet')
+            return
+        if len(arrays['dates']) <= universe.MIN_DAYS:
+            st.caption(f'The downloaded universe has only {len(arrays["dates"])} days of prices, '
+                       f'download it again')
+            return
+
+        lookback = int(st.number_input('Lookback, days', min_value=20, max_value=len(arrays['dates']) - 1,
+                                       value=min(universe.TRADING_DAYS, len(arrays['dates']) - 1),
+                                       step=21, key='screen_lookback'))
+        by = st.selectbox('Rank by', list(universe.METRICS), key='screen_by')
+        top = int(st.number_input('Top', min_value=1, max_value=MAX_TICKERS, value=10, key='screen_top'))
+        min_dollar_volume = st.number_input('Min daily dollar volume', min_value=0.0, value=1e6,
+                                            step=1e6, format='%g', key='screen_min_dollar_volume')
+        min_history = st.slider('Min share of days traded', 0.0, 1.0, 0.9, key='screen_min_history')
+
+        # thousands of tickers in one pass over the shared arrays
+        # only tickers the multiselect offers, before the top ones are taken
+        table = universe.screen(arrays, lookback, st.session_state['risk_free_rate'])
+        table = table[table.index.isin(tickers)]
+        ranked = universe.rank(table, by, top, min_history, min_dollar_volume)
+        st.dataframe(ranked[['return', 'volatility', 'sharpe', 'max_drawdown', 'dollar_volume']])
+
+        if st.button('Use in portfolio', key='screen_use'):
+            st.session_state['tickers_in_portfolio'] = list(ranked.index)
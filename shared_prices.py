@@ -0,0 +1,99 @@
+#######################
+# Imports
+#######################
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+#######################
+# Configs
+#######################
+# bytes of price arrays kept in memory for all sessions of the process together
+MEMORY_BUDGET = int(os.environ.get('PRICE_CACHE_BYTES', 512 * 1024 ** 2))
+
+
+# ================================================
+# process-wide LRU of read-only price arrays
+# ================================================
+
+def freeze(array):
+    # the array is shared by every session: writing into it raises instead of
+    # silently changing what the others see
+    array.flags.writeable = False
+    return array
+
+
+class SharedPriceCache:
+    # one entry per key with a version (e.g. the mtime of the parquet file it was read from),
+    # a different version is a miss and replaces the entry
+    # entries are immutable, callers get them as they are (no copy) and build views on them;
+    # the least recently used ones are dropped once their bytes exceed memory_budget
+
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        # build() -> (value, nbytes), runs outside the lock so that other keys aren't blocked
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == version:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return item[1]
+            self.misses += 1
+
+        value, nbytes = build()
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._items[key] = (version, value, nbytes)
+            self.nbytes += nbytes
+            # the new entry stays even if it alone is over the budget
+            while self.nbytes > self.memory_budget and len(self._items) > 1:
+                _, (_, _, evicted_nbytes) = self._items.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = len(self._items)
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else np.nan,
+                'evictions': self.evictions,
+                'size': size,
+                'megabytes': self.nbytes / 1024 ** 2,
+                'budget_megabytes': self.memory_budget / 1024 ** 2}
+
+
+# one cache per process, shared by every session and page
+# (st.cache_resource would do the same but needs streamlit >= 1.18)
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SharedPriceCache()
+        return _cache
@@ -0,0 +1,246 @@
+#######################
+# Imports
+#######################
+import numpy as np
+import pandas as pd
+
+#######################
+# Configs
+#######################
+# rows added at a time, bounds the temporary arrays of long histories
+CHUNK_ROWS = 4096
+
+# quantile sketch: relative error of every quantile and the range of |value| it resolves,
+# smaller values count as 0 and larger ones as max_value (min and max are kept exactly)
+RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-5
+MAX_VALUE = 10.0
+
+
+# ================================================
+# moments of every column in one pass
+# ================================================
+
+class Moments:
+    # count, mean and central moment sums (M2..M4) of every column,
+    # a block is reduced on its own and merged in (Welford / Terriberry, Pébay's pairwise update),
+    # so adding rows costs O(rows) and two accumulators merge in O(columns); NaNs are skipped
+
+    def __init__(self, n_columns):
+        self.count = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.m3 = np.zeros(n_columns)
+        self.m4 = np.zeros(n_columns)
+        self.min = np.full(n_columns, np.nan)
+        self.max = np.full(n_columns, np.nan)
+
+    @classmethod
+    def from_block(cls, block):
+        block = np.asarray(block, dtype=float)
+        moments = cls(block.shape[1])
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=0).astype(float)
+        if not count.any():
+            return moments
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, block, 0).sum(axis=0) / count
+            deviations = np.where(valid, block - mean, 0)
+            squares = deviations ** 2
+            moments.count = count
+            moments.mean = np.nan_to_num(mean)
+            moments.m2 = squares.sum(axis=0)
+            moments.m3 = (squares * deviations).sum(axis=0)
+            moments.m4 = (squares ** 2).sum(axis=0)
+        has_values = count > 0
+        moments.min[has_values] = np.nanmin(block[:, has_values], axis=0)
+        moments.max[has_values] = np.nanmax(block[:, has_values], axis=0)
+        return moments
+
+    def merge(self, other):
+        # in place, returns self
+        na, nb = self.count, other.count
+        n = na + nb
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = other.mean - self.mean
+            ratio = np.where(n > 0, nb / n, 0)
+            m2 = self.m2 + other.m2 + delta ** 2 * na * ratio
+            m3 = (self.m3 + other.m3
+                  + delta ** 3 * na * ratio * np.where(n > 0, (na - nb) / n, 0)
+                  + 3 * delta * np.where(n > 0, (na * other.m2 - nb * self.m2) / n, 0))
+            m4 = (self.m4 + other.m4
+                  + delta ** 4 * na * ratio * np.where(n > 0, (na ** 2 - na * nb + nb ** 2) / n ** 2, 0)
+                  + 6 * delta ** 2 * np.where(n > 0, (na ** 2 * other.m2 + nb ** 2 * self.m2) / n ** 2, 0)
+                  + 4 * delta * np.where(n > 0, (na * other.m3 - nb * self.m3) / n, 0))
+        self.mean = self.mean + delta * ratio
+        self.count, self.m2, self.m3, self.m4 = n, m2, m3, m4
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        return self
+
+    def update(self, block):
+        for start in range(0, len(block), CHUNK_ROWS):
+            self.merge(Moments.from_block(block[start:start + CHUNK_ROWS]))
+        return self
+
+    # ---------- statistics, same estimators as pandas ----------
+
+    def variance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    def skew(self):
+        # adjusted Fisher-Pearson coefficient, as Series.skew()
+        n = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            g1 = np.sqrt(n) * self.m3 / self.m2 ** 1.5
+            result = g1 * np.sqrt(n * (n - 1)) / (n - 2)
+        return np.where((n > 2) & (self.m2 > 0), result, np.where(n > 2, 0.0, np.nan))
+
+    def kurtosis(self):
+        # unbiased excess kurtosis, as Series.kurtosis()
+        n = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = ((n + 1) * n * (n - 1) * self.m4 / ((n - 2) * (n - 3) * self.m2 ** 2)
+                      - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+        return np.where((n > 3) & (self.m2 > 0), result, np.where(n > 3, 0.0, np.nan))
+
+
+# ================================================
+# mergeable quantile sketch of every column
+# ================================================
+
+class QuantileSketch:
+    # logarithmic buckets (as DDSketch) of every column: any quantile is within
+    # relative_accuracy of a value of the data, memory is fixed, adding rows is
+    # one bincount and two sketches merge by adding counts
+    # bucket layout, increasing in value: negatives (largest |value| first), zero, positives
+
+    def __init__(self, n_columns, relative_accuracy=RELATIVE_ACCURACY, min_value=MIN_VALUE, max_value=MAX_VALUE):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.n_buckets = int(np.ceil(np.log(max_value / min_value) / np.log(self.gamma))) + 1
+        self.counts = np.zeros((n_columns, 2 * self.n_buckets + 1), dtype=np.int64)
+
+    def _buckets(self, values):
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            index = np.ceil(np.log(np.maximum(magnitude, self.min_value) / self.min_value) / np.log(self.gamma))
+        index = np.clip(index, 0, self.n_buckets - 1).astype(np.int64)
+        zero = self.n_buckets
+        return np.where(magnitude < self.min_value, zero,
+                        np.where(values > 0, zero + 1 + index, zero - 1 - index))
+
+    def update(self, block):
+        block = np.asarray(block, dtype=float)
+        width = self.counts.shape[1]
+        for start in range(0, len(block), CHUNK_ROWS):
+            chunk = block[start:start + CHUNK_ROWS]
+            rows, columns = np.nonzero(~np.isnan(chunk))
+            buckets = self._buckets(chunk[rows, columns])
+            self.counts += np.bincount(columns * width + buckets,
+                                       minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        if (other.relative_accuracy, other.min_value, other.max_value) != \
+                (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError('Only sketches with the same buckets can be merged')
+        self.counts += other.counts
+        return self
+
+    def _values(self):
+        # the value every bucket stands for
+        magnitudes = self.min_value * 2 * self.gamma ** np.arange(self.n_buckets) / (self.gamma + 1)
+        magnitudes[0] = self.min_value
+        return np.concatenate([-magnitudes[::-1], [0.0], magnitudes])
+
+    def quantiles(self, qs):
+        # (columns x qs), the value of rank q * (count - 1) as pandas' lower interpolation
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        values = self._values()
+        result = np.full((len(total), len(qs)), np.nan)
+        for j, q in enumerate(qs):
+            rank = np.floor(q * (total - 1))
+            bucket = np.argmax(cumulative > rank[:, None], axis=1)
+            result[:, j] = np.where(total > 0, values[bucket], np.nan)
+        return result
+
+
+# ================================================
+# both, for a frame of returns that grows at the end
+# ================================================
+
+class ReturnStats:
+    # statistics of every column of a returns frame, the rows of a refresh are added
+    # to the accumulators instead of scanning the whole history again
+
+    def __init__(self, columns):
+        self.columns = pd.Index(columns)
+        self.moments = Moments(len(self.columns))
+        self.sketch = QuantileSketch(len(self.columns))
+        self.first_index = None
+        self.last_index = None
+        self.last_row = None
+        self.rows = 0
+
+    def update(self, returns):
+        # returns: the frame seen last time extended by new rows at the end (same columns),
+        # anything else raises ValueError and needs a new accumulator
+        if not returns.columns.equals(self.columns):
+            raise ValueError('Columns differ from the accumulated returns')
+        if self.last_index is None:
+            new = returns
+        else:
+            if len(returns) == 0 or returns.index[0] != self.first_index or self.last_index not in returns.index:
+                raise ValueError('Returns do not extend the accumulated history')
+            position = returns.index.get_loc(self.last_index)
+            if position != self.rows - 1 or not np.array_equal(
+                    returns.iloc[position].to_numpy(dtype=float), self.last_row, equal_nan=True):
+                raise ValueError('Accumulated returns changed')
+            new = returns.iloc[position + 1:]
+
+        if len(new):
+            block = new.to_numpy(dtype=float)
+            self.moments.update(block)
+            self.sketch.update(block)
+            if self.first_index is None:
+                self.first_index = returns.index[0]
+            self.last_index = returns.index[-1]
+            self.last_row = block[-1].copy()
+            self.rows = len(returns)
+        return self
+
+    def merge(self, other):
+        # statistics of two accumulators of the same columns, e.g. chunks of a history
+        # built in parallel, other holds the rows following self's
+        if not other.columns.equals(self.columns):
+            raise ValueError('Columns differ from the accumulated returns')
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        if other.last_index is not None:
+            self.first_index = other.first_index if self.first_index is None else self.first_index
+            self.last_index, self.last_row = other.last_index, other.last_row
+        self.rows += other.rows
+        return self
+
+    def table(self, percentiles):
+        # same layout as return_stats.distribution_table
+        quantiles = self.sketch.quantiles(percentiles)
+        # the sketch can't know the extremes better than the moments do
+        quantiles = np.clip(quantiles, self.moments.min[:, None], self.moments.max[:, None])
+        dfd = pd.DataFrame({'mean': np.where(self.moments.count > 0, self.moments.mean, np.nan),
+                            'std': np.sqrt(self.moments.variance()),
+                            'min': self.moments.min},
+                           index=self.columns)
+        for j, q in enumerate(percentiles):
+            dfd[f'{q * 100:g}%'] = quantiles[:, j]
+        dfd['max'] = self.moments.max
+        dfd['kurtosis'] = self.moments.kurtosis()
+        dfd['skew'] = self.moments.skew()
+        dfd['range'] = dfd['max'] - dfd['min']
+        dfd['IQR'] = dfd['75%'] - dfd['25%']
+        return dfd
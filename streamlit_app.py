@@ -1,28 +1,29 @@
 #######################
 # Imports
 #######################
+# first, so that STARTUP_PROFILE=1 sees every other import
+import lazy_imports
+
+import importlib
 import datetime as dt
 
 # streamlit
 import streamlit as st
 
-# plotly
-import plotly.io as pio
-
-# pandas datareader to download tickers from nasdaq
-import pandas_datareader as pdr
+# cached NASDAQ symbol directory
+import symbols
+# ranks the whole universe for the portfolio multiselect
+import screener
 
-# analysis and portfolio optimization
-import optimization as app1
-import analytics as app2
+# analysis and portfolio optimization pages are imported when selected
 # import app1
 # import app2
 
 #######################
 # Configs
 #######################
-# plotly config
-pio.renderers.default = 'browser'
+# plotly renderers are not configured: charts go through st.plotly_chart,
+# and importing plotly.io's renderers pulls in IPython
 
 # streamlit config
 st.set_page_config(layout="wide")
@@ -37,6 +38,10 @@ default_session_state_dict = {'disclaimer': False,
                               'risk_free_rate': 0.02,
                               'target_volatility': 0.02,
                               'target_return': 0.02,
+                              # key of the last optimization job of the session (jobs.get_queue())
+                              'optimization_job': None,
+                              # key of the last universe download of the session
+                              'universe_job': None,
                              }
 
 for key,value in default_session_state_dict.items():
@@ -48,35 +53,38 @@ for key,value in default_session_state_dict.items():
 # Stuff to preload
 #######################   
 
-# get ticker names from NASDAQ as options for multiselect
-df_tickers = pdr.nasdaq_trader.get_nasdaq_symbols(retry_count=3, timeout=30, pause=None)
-# filter them out
-mask = ((df_tickers['Financial Status'] == 'N') &
-                (df_tickers['ETF'] == False) &
-                (df_tickers['Market Category'] == 'Q') &
-                (df_tickers['Test Issue'] == False) &
-                (df_tickers['NextShares'] == False) &
-                (df_tickers['Nasdaq Traded'] == True))
-
-df_tickers = df_tickers.loc[mask]
+# get ticker names from NASDAQ as options for multiselect,
+# cached in memory and on disk, filtered once per load
+directory = symbols.get_directory()
+df_tickers = directory.tickers
 # take only names
-tickers = df_tickers.index        
+tickers = directory.symbols        
 
 
 #######################
 # Sidebar
 #######################       
-# two pages
+# two pages, module names: a page and its dependencies are imported
+# the first time it is selected, the analytics page never loads the optimizer stack
 PAGES = {
-    "Analytics": app2,
-    "Portfolio Optimization": app1
+    "Analytics": 'analytics',
+    "Portfolio Optimization": 'optimization'
 }
 
 st.sidebar.title('Navigation')
 selection = st.sidebar.radio("Go to", list(PAGES.keys()))
-page = PAGES[selection]
+
+# before the pages and the multiselect, which read the tickers it picks
+screener.sidebar(tickers)
+
+page = importlib.import_module(PAGES[selection])
 page.app(tickers)
 
+# import times since the server started (STARTUP_PROFILE=1)
+if lazy_imports.installed():
+    with st.sidebar.expander('Import times'):
+        st.dataframe(lazy_imports.report(top=50))
+
 
 
 # multiselect
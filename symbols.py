@@ -0,0 +1,140 @@
+#######################
+# Imports
+#######################
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# nasdaq directory of yahoo, or a replay / synthetic one
+import providers
+
+#######################
+# Configs
+#######################
+SYMBOLS_PATH = os.environ.get('SYMBOLS_PATH', providers.get_provider().data_path('nasdaq_symbols.parquet'))
+
+# how long the downloaded directory is trusted, seconds
+DEFAULT_TTL = float(os.environ.get('SYMBOLS_TTL', 24 * 60 * 60))
+
+
+# ================================================
+# filtering of the raw directory
+# ================================================
+# Cols description
+# http://www.nasdaqtrader.com/trader.aspx?id=symboldirdefs
+
+def filter_symbols(df_tickers):
+    mask = ((df_tickers['Financial Status'] == 'N') &
+            (df_tickers['ETF'] == False) &
+            (df_tickers['Market Category'] == 'Q') &
+            (df_tickers['Test Issue'] == False) &
+            (df_tickers['NextShares'] == False) &
+            (df_tickers['Nasdaq Traded'] == True))
+    return df_tickers.loc[mask]
+
+
+# ================================================
+# symbol directory with memory and disk cache
+# ================================================
+
+class SymbolDirectory:
+
+    def __init__(self, path=SYMBOLS_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._loaded_at = None
+        self._raw = None
+        self._tickers = None
+
+    # ---------- loading ----------
+
+    def _fetch(self):
+        return providers.get_provider().symbols()
+
+    def _disk_is_fresh(self):
+        return os.path.exists(self.path) and time.time() - os.path.getmtime(self.path) < self.ttl
+
+    def _load(self):
+        if self._disk_is_fresh():
+            raw = pd.read_parquet(self.path)
+            loaded_at = os.path.getmtime(self.path)
+        else:
+            raw = self._fetch()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            raw.to_parquet(self.path)
+            loaded_at = time.time()
+        self._build(raw)
+        self._loaded_at = loaded_at
+
+    def _build(self, raw):
+        # everything the page needs is precomputed once per load
+        self._raw = raw
+        self._tickers = filter_symbols(raw).sort_index()
+        self._names = self._tickers['Security Name'].fillna('')
+        self._symbols_upper = np.array(self._tickers.index.str.upper(), dtype=str)
+        self._names_upper = np.array(self._names.str.upper(), dtype=str)
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.time() - self._loaded_at >= self.ttl:
+            self._load()
+
+    def refresh(self):
+        # drop both caches and download again
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._loaded_at = None
+        self._ensure_loaded()
+
+    # ---------- lookups ----------
+
+    @property
+    def raw(self):
+        self._ensure_loaded()
+        return self._raw
+
+    @property
+    def tickers(self):
+        # filtered directory, index is the symbol
+        self._ensure_loaded()
+        return self._tickers
+
+    @property
+    def symbols(self):
+        return self.tickers.index
+
+    def security_names(self, symbols):
+        self._ensure_loaded()
+        return self._names.reindex(list(symbols))
+
+    def search(self, query, limit=20):
+        # symbols starting with the query first (binary search on the sorted index),
+        # then symbols and security names containing it
+        self._ensure_loaded()
+        query = query.strip().upper()
+        if not query:
+            return self._tickers.iloc[:0]
+
+        left = np.searchsorted(self._symbols_upper, query, side='left')
+        right = np.searchsorted(self._symbols_upper, query + '\uffff', side='left')
+        prefix = np.arange(left, right)
+
+        contains = np.flatnonzero((np.char.find(self._symbols_upper, query) >= 0) |
+                                  (np.char.find(self._names_upper, query) >= 0))
+        contains = contains[(contains < left) | (contains >= right)]
+
+        positions = np.concatenate([prefix, contains])[:limit]
+        return self._tickers.iloc[positions]
+
+
+# one directory per process, survives streamlit reruns
+_directory = None
+
+
+def get_directory(ttl=DEFAULT_TTL):
+    global _directory
+    if _directory is None:
+        _directory = SymbolDirectory(ttl=ttl)
+    _directory.ttl = ttl
+    return _directory
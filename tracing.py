@@ -0,0 +1,229 @@
+#######################
+# Imports
+#######################
+import os
+import json
+import time
+import uuid
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+
+import pandas as pd
+
+#######################
+# Configs
+#######################
+# finished traces kept in memory for the debug panel and the exports
+TRACE_HISTORY = 100
+
+# every finished trace is appended here as JSON lines if set
+TRACE_LOG = os.environ.get('TRACE_LOG')
+
+# prometheus text file (node_exporter textfile collector) rewritten after every trace if set
+TRACE_PROMETHEUS_FILE = os.environ.get('TRACE_PROMETHEUS_FILE')
+
+# allocated bytes need tracemalloc, which slows python code down noticeably;
+# it traces the whole process, every session, so it is set when the server starts
+TRACE_MEMORY = os.environ.get('TRACE_MEMORY', '0') == '1'
+
+METRIC_PREFIX = 'portfolio'
+
+
+# ================================================
+# spans and traces
+# ================================================
+
+class Span:
+
+    def __init__(self, name, parent, depth, start, rows=None):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        # seconds since the start of the trace
+        self.start = start
+        self.seconds = None
+        self.rows = rows
+        # net bytes still allocated at the end and the peak above the start (tracemalloc only)
+        self.allocated_bytes = None
+        self.peak_bytes = None
+        self._memory_start = None
+        self._peak_seen = None
+
+    def to_dict(self):
+        return {'name': self.name,
+                'parent': self.parent,
+                'depth': self.depth,
+                'start': self.start,
+                'seconds': self.seconds,
+                'rows': None if self.rows is None else int(self.rows),
+                'allocated_bytes': self.allocated_bytes,
+                'peak_bytes': self.peak_bytes}
+
+
+class Trace:
+    # the spans of one page run or one pipeline call, in start order
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.timestamp = time.time()
+        self.seconds = None
+        self.spans = []
+        self._started = time.perf_counter()
+        self._stack = []
+
+    def to_frame(self):
+        return pd.DataFrame([span.to_dict() for span in self.spans],
+                            columns=['name', 'parent', 'depth', 'start', 'seconds',
+                                     'rows', 'allocated_bytes', 'peak_bytes'])
+
+    def to_records(self):
+        # one JSON-able record per span
+        return [{'trace': self.name, 'trace_id': self.id, 'timestamp': self.timestamp, **span.to_dict()}
+                for span in self.spans]
+
+
+# the trace of the running script / thread, None means spans are not recorded
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def start_trace(name):
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+
+def _memory_enter(span, stack):
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1]._peak_seen = max(stack[-1]._peak_seen, peak)
+    span._memory_start = current
+    span._peak_seen = current
+    tracemalloc.reset_peak()
+
+
+def _memory_exit(span, stack):
+    current, peak = tracemalloc.get_traced_memory()
+    span._peak_seen = max(span._peak_seen, peak)
+    span.allocated_bytes = current - span._memory_start
+    span.peak_bytes = span._peak_seen - span._memory_start
+    if stack:
+        stack[-1]._peak_seen = max(stack[-1]._peak_seen, span._peak_seen)
+    tracemalloc.reset_peak()
+
+
+@contextmanager
+def span(name, rows=None):
+    # times the block as a child of the innermost open span,
+    # the yielded span takes rows set later on (span.rows = len(df))
+    trace = _current.get()
+    if trace is None:
+        yield Span(name, None, 0, 0.0, rows)
+        return
+
+    stack = trace._stack
+    parent = stack[-1].name if stack else None
+    current = Span(name, parent, len(stack), time.perf_counter() - trace._started, rows)
+    memory = tracemalloc.is_tracing()
+    if memory:
+        _memory_enter(current, stack)
+    trace.spans.append(current)
+    stack.append(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - started
+        stack.pop()
+        if memory:
+            _memory_exit(current, stack)
+
+
+# ================================================
+# finished traces and metrics of this process
+# ================================================
+
+_lock = threading.Lock()
+recent = deque(maxlen=TRACE_HISTORY)
+# (trace, span) -> [count, seconds, rows, allocated bytes], since the process started
+_totals = {}
+
+
+def finish_trace(trace=None):
+    trace = trace or _current.get()
+    if trace is None:
+        return None
+    trace.seconds = time.perf_counter() - trace._started
+    _current.set(None)
+
+    with _lock:
+        recent.append(trace)
+        for s in trace.spans:
+            if s.seconds is None:
+                continue
+            totals = _totals.setdefault((trace.name, s.name), [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += s.seconds
+            totals[2] += s.rows or 0
+            totals[3] += max(s.allocated_bytes or 0, 0)
+
+    if TRACE_LOG:
+        with open(TRACE_LOG, 'a') as f:
+            f.write(to_jsonl([trace]))
+    if TRACE_PROMETHEUS_FILE:
+        tmp_path = TRACE_PROMETHEUS_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, TRACE_PROMETHEUS_FILE)
+    return trace
+
+
+def enable_memory(enabled=True):
+    # allocated bytes for all following spans of the process
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+if TRACE_MEMORY:
+    enable_memory()
+
+
+# ================================================
+# exports
+# ================================================
+
+def to_jsonl(traces=None):
+    # one line per span
+    traces = list(recent) if traces is None else traces
+    return ''.join(json.dumps(record) + '\n' for trace in traces for record in trace.to_records())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    # counters over every finished trace of the process, in the text exposition format
+    metrics = [('span_seconds_total', 'counter', 'Wall time spent in the span', 1),
+               ('span_calls_total', 'counter', 'Finished spans', 0),
+               ('span_rows_total', 'counter', 'Rows processed in the span', 2),
+               ('span_allocated_bytes_total', 'counter', 'Bytes allocated in the span (tracemalloc)', 3)]
+    with _lock:
+        totals = sorted(_totals.items())
+    lines = []
+    for metric, kind, help_text, position in metrics:
+        name = f'{METRIC_PREFIX}_{metric}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (trace, span_name), values in totals:
+            lines.append(f'{name}{{trace="{_escape(trace)}",span="{_escape(span_name)}"}} {values[position]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,222 @@
+#######################
+# Imports
+#######################
+import os
+import time
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import downloader
+import providers
+import price_store
+import shared_prices
+import symbols
+import jobs
+
+#######################
+# Configs
+#######################
+TRADING_DAYS = 252
+
+# recent closes and volumes of the whole universe, long format: Date, Ticker, Adj Close, Volume
+UNIVERSE_PATH = os.environ.get('UNIVERSE_PATH', providers.get_provider().data_path('universe.parquet'))
+
+# business days kept in the universe snapshot, the longest lookback of a screen
+LOOKBACK_DAYS = int(os.environ.get('UNIVERSE_LOOKBACK_DAYS', 2 * TRADING_DAYS))
+
+# tickers refreshed per provider call: the downloaded bars of one batch are
+# written to the store before the next batch starts
+BATCH_SIZE = 200
+
+# concurrent downloads of a batch (yahoo), see downloader.fetch_many
+WORKERS = downloader.WORKERS
+
+# fewer days of history can't be screened, such a snapshot is never written
+MIN_DAYS = 20
+
+# metric -> ascending, True when smaller is better
+METRICS = {'sharpe': False,
+           'return': False,
+           'volatility': True,
+           'max_drawdown': False,
+           'dollar_volume': False}
+
+
+# ================================================
+# ingestion of the filtered universe
+# ================================================
+
+def _recent(ticker, start, store_dir):
+    # Adj Close and Volume of the stored window, None if nothing is stored
+    df = price_store.read_ticker(ticker, start=start, store_dir=store_dir)
+    if df is None or df.empty:
+        return None
+    df = df.reindex(columns=['Adj Close', 'Volume'])
+    df['Ticker'] = ticker
+    return df.reset_index()
+
+
+def ingest(tickers,
+           lookback=LOOKBACK_DAYS,
+           batch_size=BATCH_SIZE,
+           workers=WORKERS,
+           store_dir=price_store.STORE_DIR,
+           path=UNIVERSE_PATH):
+    # refreshes every ticker in the price store, batch by batch with at most workers
+    # downloads at a time, then writes the last lookback days of all of them to path
+    # (unless there are no more than MIN_DAYS dates: the previous snapshot is kept)
+    # a checkpoint of the caller's job between batches
+    # returns {'tickers' (in the snapshot), 'rows', 'written', 'failures' (report), 'seconds'}
+    started = time.time()
+    tickers = list(tickers)
+    n_batches = -(-len(tickers) // batch_size)
+    failures = []
+    for i in range(n_batches):
+        jobs.checkpoint(0.9 * i / max(n_batches, 1), f'download batch {i + 1} of {n_batches}')
+        batch = tickers[i * batch_size:(i + 1) * batch_size]
+        # every file is locked only while it is written, pages refresh their tickers meanwhile
+        failures.append(price_store.refresh_tickers(batch, store_dir, workers=workers))
+
+    jobs.checkpoint(0.9, 'universe snapshot')
+    start = (pd.Timestamp.today().normalize() - pd.offsets.BDay(lookback + 1)).date()
+    frames = [df for df in (_recent(ticker, start, store_dir) for ticker in tickers) if df is not None]
+    if frames:
+        snapshot = pd.concat(frames, ignore_index=True)
+    else:
+        snapshot = pd.DataFrame({'Date': pd.DatetimeIndex([]), 'Adj Close': [], 'Volume': [], 'Ticker': []})
+    snapshot['Ticker'] = snapshot['Ticker'].astype('category')
+    snapshot['Adj Close'] = snapshot['Adj Close'].astype(np.float32)
+    snapshot['Volume'] = snapshot['Volume'].astype(np.float32)
+
+    written = snapshot['Date'].nunique() > MIN_DAYS
+    if written:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first so a crash never leaves a broken parquet behind
+        tmp_path = path + '.tmp'
+        snapshot[['Date', 'Ticker', 'Adj Close', 'Volume']].to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    return {'tickers': len(frames),
+            'rows': len(snapshot),
+            'written': written,
+            'failures': pd.concat(failures) if failures else downloader.failure_report([]),
+            'seconds': time.time() - started}
+
+
+# ================================================
+# the snapshot as (time x ticker) arrays shared by all sessions
+# ================================================
+
+def _version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def exists(path=UNIVERSE_PATH):
+    return _version(path) is not None
+
+
+def _matrices(path):
+    # long snapshot -> dates, tickers and (time x ticker) close and volume, NaN where missing
+    df = pd.read_parquet(path)
+    dates, rows = np.unique(df['Date'].to_numpy(dtype='datetime64[ns]'), return_inverse=True)
+    tickers = pd.Categorical(df['Ticker'])
+    columns = tickers.codes
+    close = np.full((len(dates), len(tickers.categories)), np.nan)
+    volume = np.full((len(dates), len(tickers.categories)), np.nan)
+    close[rows, columns] = df['Adj Close'].to_numpy(dtype=float)
+    volume[rows, columns] = df['Volume'].to_numpy(dtype=float)
+    arrays = {'dates': shared_prices.freeze(dates),
+              'tickers': list(tickers.categories),
+              'close': shared_prices.freeze(close),
+              'volume': shared_prices.freeze(volume)}
+    return arrays, dates.nbytes + close.nbytes + volume.nbytes
+
+
+def load(path=UNIVERSE_PATH):
+    # {'dates', 'tickers', 'close', 'volume'} of the snapshot or None, read again when it changes
+    version = _version(path)
+    if version is None:
+        return None
+    return shared_prices.get_cache().get(('universe', path), version, lambda: _matrices(path))
+
+
+# ================================================
+# screening
+# ================================================
+
+def screen(universe, lookback=TRADING_DAYS, risk_free_rate=0.02):
+    # metrics of every ticker over the last lookback days, one vectorized pass over the arrays
+    # returns a frame indexed by ticker: return (annual, compounded), volatility (annual),
+    # sharpe, max_drawdown (negative), dollar_volume (median daily), history (share of days traded),
+    # last_price
+    if len(universe['dates']) <= MIN_DAYS:
+        raise ValueError(f'The universe snapshot has {len(universe["dates"])} days, '
+                         f'more than {MIN_DAYS} are needed to screen it')
+    close = universe['close'][-(lookback + 1):]
+    volume = universe['volume'][-(lookback + 1):]
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        # tickers without a single return in the window are all NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        returns = close[1:] / close[:-1] - 1
+        observed = np.sum(~np.isnan(returns), axis=0)
+        annual_return = np.expm1(np.nanmean(np.log1p(returns), axis=0) * TRADING_DAYS)
+        volatility = np.nanstd(returns, axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+        # NaN never raises the running peak
+        drawdown = close / np.fmax.accumulate(close, axis=0) - 1
+        max_drawdown = np.nanmin(drawdown, axis=0)
+        dollar_volume = np.nanmedian(close * volume, axis=0)
+        sharpe = (annual_return - risk_free_rate) / volatility
+
+    last = len(close) - 1 - np.argmax(~np.isnan(close[::-1]), axis=0)
+    last_price = close[last, np.arange(close.shape[1])]
+    return pd.DataFrame({'return': annual_return,
+                         'volatility': volatility,
+                         'sharpe': np.where(volatility > 0, sharpe, np.nan),
+                         'max_drawdown': max_drawdown,
+                         'dollar_volume': dollar_volume,
+                         'history': observed / max(len(returns), 1),
+                         'last_price': last_price},
+                        index=pd.Index(universe['tickers'], name='Symbol'))
+
+
+def rank(table, by='sharpe', top=20, min_history=0.9, min_dollar_volume=0.0):
+    # best top tickers of a screen() table by one of METRICS,
+    # tickers with gaps or too little trading are dropped first
+    keep = (table['history'] >= min_history) & (table['dollar_volume'] >= min_dollar_volume) & table[by].notna()
+    ranked = table.loc[keep].sort_values(by, ascending=METRICS[by], kind='stable')
+    return ranked.head(top)
+
+
+# ================================================
+# command line
+# ================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download the filtered NASDAQ universe and screen it')
+    parser.add_argument('--lookback', type=int, default=LOOKBACK_DAYS,
+                        help='business days kept in the universe snapshot')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='concurrent downloads')
+    parser.add_argument('--limit', type=int, default=None, help='first tickers of the universe only')
+    parser.add_argument('--by', choices=list(METRICS), default='sharpe')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    tickers = list(symbols.get_directory().symbols)[:args.limit]
+    report = ingest(tickers, lookback=args.lookback, batch_size=args.batch_size, workers=args.workers)
+    print(f'{report["tickers"]} tickers, {report["rows"]} rows, {len(report["failures"])} failed '
+          f'in {report["seconds"]:.1f}s -> {UNIVERSE_PATH if report["written"] else "not written, too short"}')
+    if not exists():
+        return
+    print(rank(screen(load()), by=args.by, top=args.top).to_string())
+
+
+if __name__ == '__main__':
+    main()